@@ -7,7 +7,7 @@ from dotenv import load_dotenv
 import os
 
 from pybeansack.models import *
-from app.shared import AppContext
+from app.shared import AppContext, profiling
 from app.shared.consts import *
 
 load_dotenv()
@@ -156,6 +156,7 @@ def verify_api_key(request: Request):
 api_key_dependency = Depends(verify_api_key)
 
 app = FastAPI(title=NAME, version=VERSION, description=DESCRIPTION, lifespan=lifespan)
+app.include_router(profiling.router) # off unless PROFILING_ENABLED is set
 
 # @app.get("/")
 # async def root():
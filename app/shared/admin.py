@@ -0,0 +1,13 @@
+import hmac
+import os
+from fastapi import HTTPException, Request
+
+ADMIN_KEY_HEADER = "X-Admin-Key"
+
+def verify_admin_key(request: Request):
+    """Admin endpoints only exist when ADMIN_API_KEY is configured and only answer requests that present it"""
+    admin_key = os.getenv("ADMIN_API_KEY")
+    if not admin_key: raise HTTPException(status_code=404, detail="Not Found")
+    # constant time so that the key cannot be guessed byte by byte from response times
+    if not hmac.compare_digest(request.headers.get(ADMIN_KEY_HEADER, "").encode(), admin_key.encode()): raise HTTPException(status_code=401, detail="Invalid Admin Key")
+    return True
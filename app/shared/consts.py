@@ -52,6 +52,7 @@ RESOURCE_NOT_FOUND = "Never heard of 'em"
 # UNKNOWN = "💩 ... I don't know what this is."
 UNKNOWN_INPUT = "Yeah ... so, I don't know what this is. I'm just going to go ahead search for: %s"
 UNKNOWN_ERROR = "💩 ... try again?!"
+TOO_BUSY = "Too many people brewing right now ... try again in a moment?!"
 
 PROCESSING = "🏃⛏️💩..."
 PUBLISHED = "👍 Published"
@@ -0,0 +1,155 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from app.shared.admin import verify_admin_key
+
+MAX_PROFILE_SECONDS = 60
+MIN_INTERVAL_MS = 5
+MAX_STACK_DEPTH = 64
+MAX_TRACE_FRAMES = 25
+MAX_TRACE_SECONDS = 3600
+MAX_STATS = 200
+_TRACE_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>")
+]
+
+def verify_profiling_enabled():
+    """Profiling endpoints only exist when PROFILING_ENABLED is set"""
+    if os.getenv("PROFILING_ENABLED", "").lower() not in ("1", "true", "yes"): raise HTTPException(status_code=404, detail="Not Found")
+    return True
+
+_frame_name = lambda frame: f"{frame.f_globals.get('__name__', frame.f_code.co_filename)}:{frame.f_code.co_name}"
+
+def _collapse(frame) -> str:
+    names = []
+    while frame and len(names) < MAX_STACK_DEPTH:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+def sample_stacks(seconds: float, interval: float) -> Counter:
+    """Samples the stacks of all threads except the calling one every `interval` seconds for `seconds`.
+    Returns the collapsed stacks (thread name first, root frame to leaf frame) with the number of samples they showed up in"""
+    me = threading.get_ident()
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me: continue
+            stacks[f"{names.get(ident, ident)};{_collapse(frame)}"] += 1
+        time.sleep(interval)
+    return stacks
+
+_profile_lock = threading.Lock()
+
+def profile(seconds: float, interval_ms: int) -> str:
+    """Runs one bounded sampling profile and returns it in the collapsed stack format that flamegraph.pl and speedscope read"""
+    if not _profile_lock.acquire(blocking=False): raise HTTPException(status_code=409, detail="A profile is already running")
+    try: stacks = sample_stacks(min(seconds, MAX_PROFILE_SECONDS), max(interval_ms, MIN_INTERVAL_MS)/1000)
+    finally: _profile_lock.release()
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+
+class MemoryTracer:
+    """Wraps tracemalloc so that tracing is only on between start and stop, never outlives `max_seconds` and keeps one baseline snapshot to diff against"""
+    def __init__(self):
+        self._baseline = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def start(self, frames: int, max_seconds: int):
+        with self._lock:
+            if not tracemalloc.is_tracing(): tracemalloc.start(frames)
+            self._baseline = self._take()
+            if self._timer: self._timer.cancel()
+            self._timer = threading.Timer(max_seconds, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+        return self.status()
+
+    def stop(self):
+        with self._lock:
+            if self._timer: self._timer.cancel()
+            self._timer, self._baseline = None, None
+            tracemalloc.stop()
+        return self.status()
+
+    def status(self) -> dict:
+        if not tracemalloc.is_tracing(): return {"tracing": False}
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "tracing": True,
+            "frames": tracemalloc.get_traceback_limit(),
+            "traced_bytes": current,
+            "peak_traced_bytes": peak,
+            "overhead_bytes": tracemalloc.get_tracemalloc_memory()
+        }
+
+    def _take(self):
+        return tracemalloc.take_snapshot().filter_traces(_TRACE_FILTERS)
+
+    def _ensure_tracing(self):
+        if not tracemalloc.is_tracing(): raise HTTPException(status_code=409, detail="Memory tracing is not started")
+
+    def snapshot(self, group_by: str, limit: int) -> list[dict]:
+        """Top allocation sites of the memory that is alive right now"""
+        self._ensure_tracing()
+        return [{"trace": _format_trace(stat.traceback, group_by), "size": stat.size, "count": stat.count} for stat in self._take().statistics(group_by)[:limit]]
+
+    def diff(self, group_by: str, limit: int, reset: bool) -> list[dict]:
+        """Allocation sites that grew the most since the baseline snapshot. With `reset` the current snapshot becomes the new baseline"""
+        self._ensure_tracing()
+        current = self._take()
+        with self._lock:
+            baseline = self._baseline or current
+            if reset: self._baseline = current
+        return [
+            {"trace": _format_trace(stat.traceback, group_by), "size": stat.size, "size_diff": stat.size_diff, "count": stat.count, "count_diff": stat.count_diff}
+            for stat in current.compare_to(baseline, group_by)[:limit]
+        ]
+
+def _format_trace(traceback: tracemalloc.Traceback, group_by: str):
+    if group_by == "filename": return traceback[0].filename
+    if group_by == "lineno": return f"{traceback[0].filename}:{traceback[0].lineno}"
+    return [f"{frame.filename}:{frame.lineno}" for frame in traceback]
+
+memory_tracer = MemoryTracer()
+
+GROUP_BY = Query(default="lineno", pattern="^(filename|lineno|traceback)$")
+LIMIT = Query(default=25, ge=1, le=MAX_STATS)
+
+router = APIRouter(prefix="/admin/profile", tags=["admin"], include_in_schema=False, dependencies=[Depends(verify_admin_key), Depends(verify_profiling_enabled)])
+
+@router.get("/cpu", response_class=PlainTextResponse)
+async def cpu_profile(seconds: float = Query(default=10, gt=0, le=MAX_PROFILE_SECONDS), interval_ms: int = Query(default=10, ge=MIN_INTERVAL_MS, le=1000)):
+    # the sampler runs on its own thread so that the event loop keeps serving and shows up in the samples
+    return await asyncio.to_thread(profile, seconds, interval_ms)
+
+@router.post("/memory/start")
+async def start_memory_tracing(frames: int = Query(default=10, ge=1, le=MAX_TRACE_FRAMES), max_seconds: int = Query(default=600, ge=1, le=MAX_TRACE_SECONDS)):
+    return await asyncio.to_thread(memory_tracer.start, frames, max_seconds)
+
+@router.post("/memory/stop")
+async def stop_memory_tracing():
+    return memory_tracer.stop()
+
+@router.get("/memory")
+async def memory_status():
+    return memory_tracer.status()
+
+@router.get("/memory/snapshot")
+async def memory_snapshot(group_by: str = GROUP_BY, limit: int = LIMIT):
+    return await asyncio.to_thread(memory_tracer.snapshot, group_by, limit)
+
+@router.get("/memory/diff")
+async def memory_diff(group_by: str = GROUP_BY, limit: int = LIMIT, reset: bool = True):
+    return await asyncio.to_thread(memory_tracer.diff, group_by, limit, reset)
@@ -0,0 +1,81 @@
+import asyncio
+import inspect
+import os
+from functools import wraps
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor, ConsoleSpanExporter
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+TRACER_NAME = "espresso"
+
+tracer = trace.get_tracer(TRACER_NAME)
+memory_exporter = InMemorySpanExporter() # holds the finished spans when the exporter is "memory", e.g. for local tests
+
+def configure_tracing(exporter: str = "azure", sample_ratio: float = 1.0, service_name: str = None):
+    """Sets up the global tracer provider with parent based head sampling at `sample_ratio`. 
+    `exporter` is one of "azure" (Azure Monitor, needs APPLICATIONINSIGHTS_CONNECTION_STRING), "otlp", "console", "memory" or "none".
+    Without the connection string "azure" falls back to "none" so that local runs start without it."""
+    service_name = service_name or os.getenv("OTEL_SERVICE_NAME", TRACER_NAME)
+    if exporter == "azure" and not os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING"): exporter = "none"
+    if exporter == "none": return
+    if exporter == "azure":
+        from azure.monitor.opentelemetry import configure_azure_monitor
+        configure_azure_monitor(sampling_ratio=sample_ratio, resource=Resource.create({"service.name": service_name}))
+        return
+
+    provider = TracerProvider(sampler=ParentBased(TraceIdRatioBased(sample_ratio)), resource=Resource.create({"service.name": service_name}))
+    if exporter == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    elif exporter == "console": provider.add_span_processor(SimpleSpanProcessor(ConsoleSpanExporter()))
+    elif exporter == "memory": provider.add_span_processor(SimpleSpanProcessor(memory_exporter))
+    else: raise ValueError(f"Unknown tracing exporter: {exporter}")
+    trace.set_tracer_provider(provider)
+
+def instrument_app(app):
+    """Spans for every request handled by the FastAPI app. Skipped when the instrumentation package is not installed"""
+    try: from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+    except ImportError: return
+    FastAPIInstrumentor.instrument_app(app)
+
+def set_attribute(key: str, value):
+    """Sets an attribute on the current span, if there is one being recorded"""
+    span = trace.get_current_span()
+    if span.is_recording(): span.set_attribute(key, value)
+
+def traced(func = None, *, name: str = None):
+    """Runs the function in its own span named after its module and name. Works for both sync and async functions"""
+    def decorator(func):
+        span_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                with tracer.start_as_current_span(span_name):
+                    return await func(*args, **kwargs)
+        else:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with tracer.start_as_current_span(span_name):
+                    return func(*args, **kwargs)
+        # keep pointing at the undecorated function so that callers can still bypass the caching layers underneath
+        wrapper.__wrapped__ = getattr(func, "__wrapped__", func)
+        return wrapper
+    return decorator(func) if func else decorator
+
+class TracedProxy:
+    """Wraps a client object so that every method call on it runs in a `<prefix>.<method>` span. 
+    Everything that is not a function or method passes through untouched, including callable objects like pymongo collections.
+    `children` names attributes that are client objects of their own, e.g. the collections of a database, and get their own `<prefix>.<name>` proxies"""
+    def __init__(self, target, prefix: str, children: tuple[str, ...] = ()):
+        self._target = target
+        self._prefix = prefix
+        self._children = {name: TracedProxy(getattr(target, name), f"{prefix}.{name}") for name in children}
+
+    def __getattr__(self, name):
+        if name in self._children: return self._children[name]
+        attr = getattr(self._target, name)
+        if not inspect.isroutine(attr): return attr
+        return traced(attr, name=f"{self._prefix}.{name}")
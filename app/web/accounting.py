@@ -0,0 +1,111 @@
+import asyncio
+import json
+import random
+import sys
+from collections import defaultdict
+from typing import Callable
+from nicegui import Client, core, ui
+from app.shared.env import *
+from app.web import metrics
+
+class ClientUsage:
+    """What a connected client costs the server: beans retained for it and bytes pushed to it over the websocket.
+    Retained beans and degraders are tracked per owning element so that they are let go of once that element is deleted, e.g. when a panel is refreshed"""
+    __slots__ = ("route", "held", "ws_bytes", "degraders")
+
+    def __init__(self, route: str):
+        self.route = route
+        self.held: dict[int, int] = {} # owner element id -> bytes
+        self.ws_bytes = 0
+        self.degraders: dict[int, Callable] = {} # owner element id -> degrader
+
+    @property
+    def bean_bytes(self) -> int:
+        return sum(self.held.values())
+
+    def prune(self, client: Client):
+        """Forgets the beans and degraders of owners that are no longer part of the page"""
+        for owners in (self.held, self.degraders):
+            for owner_id in [owner_id for owner_id in owners if owner_id not in client.elements]: owners.pop(owner_id, None)
+
+_usage: dict[str, ClientUsage] = {}
+
+def approx_size(bean) -> int:
+    """Rough retained size of a bean: the object itself plus its string and list payloads"""
+    size = sys.getsizeof(bean)
+    values = [getattr(bean, name) for name in bean.__slots__] if hasattr(bean, "__slots__") else vars(bean).values()
+    for value in values:
+        size += sys.getsizeof(value)
+        if isinstance(value, list): size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+def _usage_for(client: Client) -> ClientUsage:
+    usage = _usage.get(client.id)
+    if usage is None:
+        usage = _usage[client.id] = ClientUsage(client.page.path if client.page else None)
+    return usage
+
+def _live_clients():
+    """Usage of the clients that still exist. Clients survive transient disconnects and reconnect with the same id, 
+    so their usage is dropped only once nicegui has deleted them"""
+    for client_id, usage in list(_usage.items()):
+        client = Client.instances.get(client_id)
+        if client: yield client_id, client, usage
+        else: _usage.pop(client_id, None)
+
+def hold(beans: list, owner: ui.element):
+    """Attributes the beans to the client of `owner` as retained memory for as long as `owner` is on the page"""
+    if not beans: return
+    held = _usage_for(owner.client).held
+    held[owner.id] = held.get(owner.id, 0) + sum(map(approx_size, beans))
+
+def on_over_budget(degrade, owner: ui.element):
+    """Registers a callback that frees memory of `owner` when its client goes over its budget. 
+    The callback returns the beans it let go of, or None. It is dropped along with `owner`"""
+    _usage_for(owner.client).degraders[owner.id] = degrade
+    return degrade
+
+def _over_budget(client: Client, usage: ClientUsage) -> bool:
+    return len(client.elements) > config.accounting.max_elements or usage.bean_bytes > config.accounting.max_bean_bytes
+
+def enforce_budgets():
+    for client_id, client, usage in _live_clients():
+        usage.prune(client)
+        if not _over_budget(client, usage): continue
+        metrics.increment("client_over_budget")
+        for owner_id, degrade in list(usage.degraders.items()):
+            try:
+                with client: dropped = degrade()
+                if dropped and owner_id in usage.held: usage.held[owner_id] = max(usage.held[owner_id] - sum(map(approx_size, dropped)), 0)
+            except Exception as err:
+                log("client_degrade_error", client_id=client_id, error=str(err))
+            if not _over_budget(client, usage): break
+
+async def watch_budgets(interval: int):
+    """Degrades the clients that are over their element or memory budget every `interval` seconds"""
+    while True:
+        enforce_budgets()
+        await asyncio.sleep(interval)
+
+def count_websocket_bytes(sample_rate: float):
+    """Wraps the socket.io emitter so that the messages pushed to a client are counted against it.
+    Only a `sample_rate` share of the messages is serialized for measuring, the counts are scaled up accordingly"""
+    emit = core.sio.emit
+    async def counted_emit(event, data=None, *args, room=None, **kwargs):
+        client = Client.instances.get(room) if room and random.random() < sample_rate else None
+        if client: _usage_for(client).ws_bytes += int(len(json.dumps(data, default=str)) / sample_rate)
+        return await emit(event, data, *args, room=room, **kwargs)
+    core.sio.emit = counted_emit
+
+def snapshot() -> dict:
+    clients, routes = {}, defaultdict(lambda: defaultdict(int))
+    for client_id, client, usage in _live_clients():
+        usage.prune(client)
+        elements = len(client.elements)
+        clients[client_id] = {"route": usage.route, "elements": elements, "bean_bytes": usage.bean_bytes, "ws_bytes": usage.ws_bytes}
+        route = routes[usage.route]
+        route["clients"] += 1
+        route["elements"] += elements
+        route["bean_bytes"] += usage.bean_bytes
+        route["ws_bytes"] += usage.ws_bytes
+    return {"clients": clients, "routes": {route: dict(totals) for route, totals in routes.items()}}
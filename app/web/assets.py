@@ -0,0 +1,94 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from starlette.requests import Request
+from starlette.responses import Response
+from app.shared.env import *
+from app.web import metrics
+
+try: import brotli
+except ImportError: brotli = None # brotli variants are only built when the package is installed
+
+# docs and images are indexed once at startup with content-hashed urls and precompressed variants so that serving them never touches the disk
+COMPRESSIBLE = {".md", ".json", ".css", ".html", ".svg", ".txt", ".ico"}
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+class Asset:
+    __slots__ = ("name", "hashed_name", "media_type", "digest", "data", "gzip", "brotli")
+
+    def __init__(self, name: str, data: bytes):
+        digest = hashlib.sha256(data).hexdigest()
+        stem, ext = os.path.splitext(name)
+        self.name = name
+        self.hashed_name = f"{stem}.{digest[:10]}{ext}"
+        self.media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if ext == ".md": self.media_type = "text/markdown"
+        self.digest = digest[:32]
+        self.data = data
+        compressible = ext in COMPRESSIBLE and len(data) > 512
+        self.gzip = gzip.compress(data, compresslevel=9, mtime=0) if compressible else None
+        self.brotli = brotli.compress(data) if (compressible and brotli) else None
+
+    def etag(self, encoding: str = None) -> str:
+        """Strong validator of one content-coding of the asset. Every coding is a different byte sequence so each gets its own tag"""
+        return f'"{self.digest}-{encoding}"' if encoding else f'"{self.digest}"'
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match uses the weak comparison: W/ prefixes are ignored and any tag in the list (or *) matches"""
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+class AssetManifest:
+    """In-memory index of the static assets under each root keyed by both the plain and the content-hashed url path"""
+    def __init__(self, roots: dict[str, str]):
+        self.roots = roots
+        self._assets: dict[str, Asset] = {}
+        self._urls: dict[str, str] = {}
+
+    def build(self):
+        for prefix, dir in self.roots.items():
+            if not os.path.isdir(dir): continue
+            for name in sorted(os.listdir(dir)):
+                path = os.path.join(dir, name)
+                if not os.path.isfile(path): continue
+                with open(path, "rb") as file: asset = Asset(name, file.read())
+                self._assets[f"/{prefix}/{name}"] = asset
+                self._assets[f"/{prefix}/{asset.hashed_name}"] = asset
+                self._urls[f"/{prefix}/{name}"] = f"/{prefix}/{asset.hashed_name}"
+        log("assets_indexed", count=len(self._urls))
+        return self
+
+    def get(self, path: str) -> Asset|None:
+        return self._assets.get(path)
+
+    def url(self, path: str) -> str:
+        """Content-hashed url of the asset or the path itself if it is not indexed"""
+        return self._urls.get(path, path)
+
+    def rewrite(self, html: str) -> str:
+        """Points every asset url in the markup at its content-hashed version"""
+        return re.sub(r"/(?:%s)/[\w.\-]+" % "|".join(map(re.escape, self.roots)), lambda match: self.url(match.group(0)), html)
+
+    def response(self, request: Request, path: str) -> Response|None:
+        asset = self._assets.get(path)
+        if not asset: return None
+        accepted = request.headers.get("accept-encoding", "")
+        body, encoding = asset.data, None
+        if asset.brotli and "br" in accepted: body, encoding = asset.brotli, "br"
+        elif asset.gzip and "gzip" in accepted: body, encoding = asset.gzip, "gzip"
+        # a hashed url can never change content, a plain one has to be revalidated against the etag
+        headers = {
+            "ETag": asset.etag(encoding), 
+            "Cache-Control": IMMUTABLE if path.endswith(asset.hashed_name) else f"public, max-age={config.assets.max_age}, must-revalidate",
+            "Vary": "Accept-Encoding"
+        }
+        if _matches(request.headers.get("if-none-match", ""), headers["ETag"]):
+            metrics.increment("asset_not_modified")
+            return Response(status_code=304, headers=headers)
+        if encoding: headers["Content-Encoding"] = encoding
+        metrics.increment("asset_served")
+        return Response(body, media_type=asset.media_type, headers=headers)
+
+manifest = AssetManifest({"docs": config.assets.docs_dir, "images": config.assets.images_dir}).build()
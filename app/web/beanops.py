@@ -1,3 +1,10 @@
+import asyncio
+import bisect
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+import numpy as np
 from memoization import cached
 from icecream import ic
 from nicegui import run
@@ -6,9 +13,15 @@ from app.shared.utils import *
 from app.shared.env import *
 from app.shared.consts import *
 from app.web.context import *
+from app.web import lanes
+from app.shared.tracing import traced, set_attribute, TracedProxy
+from app.web.caching import TTLCache, make_key, swr_cached, circuit_guarded, on_data_refresh, notify_data_refresh, run_in_background
 
 CACHE_SIZE = 100
 
+# every beansack call gets its own span, so do the raw queries on its beanstore collection
+db = TracedProxy(db, "beansack", children=("beanstore",))
+
 # BEAN_HEADER_FIELDS = {
 #     K_ID: 1, K_URL: 1, K_TITLE: 1,
 #     K_KIND: 1, K_IMAGEURL: 1, 
@@ -39,30 +52,219 @@ BEAN_HEADER_FIELDS = [
     K_KIND, K_IMAGEURL, 
     K_SOURCE, K_AUTHOR,
     K_CATEGORIES, K_ENTITIES, K_REGIONS,    
-    K_LIKES, K_COMMENTS, K_SHARES, K_CLUSTER_SIZE
+    K_LIKES, K_COMMENTS, K_SHARES, K_CLUSTER_ID, K_CLUSTER_SIZE
 ]
+CLUSTER_MEMBER_FIELDS = BEAN_HEADER_FIELDS + [K_SUMMARY]
+CLUSTER_CACHE_SIZE = 1000
+BEAN_BODY_CACHE_SIZE = 5000
+USER_CACHE_SIZE = 1000
 
+class BeanHeader:
+    """Compact stand-in for `Bean` in cached feed results. Holds the header fields (plus the summary fields of cluster members and bodies) in slots 
+    instead of a pydantic model and its per-instance dicts. Attributes that a header does not carry read as None, same as an unprojected `Bean` field."""
+    __slots__ = (
+        "id", "url", "title", "created", "updated", "kind", "image_url", "source", "author",
+        "categories", "entities", "regions", "likes", "comments", "shares", "cluster_id", "cluster_size",
+        "summary", "chatter", "publisher", "embedding"
+    )
 
-@cached(max_size=1, ttl=ONE_WEEK)
-def get_all_sources():
-    return sorted(db.beanstore.distinct(K_SOURCE))
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
 
-def load_bean_body(bean: Bean):
-    res = db.get_bean(url=bean.url, project=BEAN_SUMMARY_FIELDS)
-    bean.entities = res.entities
-    bean.author = res.author
-    bean.summary = res.summary
+    def __getattr__(self, name):
+        # only reached for names outside the slots: other `Bean` fields read as None, anything else is a typo and fails like it would on a `Bean`
+        if name in Bean.model_fields: return None
+        raise AttributeError(f"'BeanHeader' object has no attribute '{name}'")
+
+    def __repr__(self):
+        return f"BeanHeader(url={self.url!r})"
+
+    @classmethod
+    def from_row(cls, row: dict):
+        """Builds the header straight from a beanstore document without going through `Bean`"""
+        return cls(**{**row, "id": row.get("_id", row.get("id"))})
+
+    @classmethod
+    def from_bean(cls, bean: Bean):
+        return cls(**{name: getattr(bean, name, None) for name in cls.__slots__})
+
+def _compact(beans):
+    """Swaps the beans of a DB result for headers keeping the collection type. None stays None for the circuit breaker"""
+    if beans is None: return None
+    return type(beans)(map(BeanHeader.from_bean, beans)) if isinstance(beans, (list, tuple)) else beans
+
+
+def canonical_filter_key(*args, **kwargs):
+    """Cache key that is the same for equivalent filters regardless of the order of tags and sources"""
+    return make_key(tuple(map(_canonical, args)), {key: _canonical(value) for key, value in kwargs.items()})
+
+PAGE_QUERY_FIELDS = ("query_urls", "query_tags", "query_sources", "query_distance")
+
+def page_version(page: Page) -> str:
+    """Digest of everything a page's feed depends on, so that an edited page (e.g. a new bookmark) gets new cache keys"""
+    digest = hashlib.sha1(repr([getattr(page, field, None) for field in PAGE_QUERY_FIELDS]).encode())
+    if page.query_embedding is not None: digest.update(np.asarray(page.query_embedding, dtype=np.float32).tobytes())
+    return digest.hexdigest()[:16]
+
+def _canonical(value):
+    if isinstance(value, (Bean, BeanHeader)): return value.url
+    if isinstance(value, Page): return (value.id, page_version(value))
+    if isinstance(value, (list, tuple)): return tuple(sorted((_canonical(item) for item in value if item), key=repr))
+    return value
+
+def canonical_tag(tag: str) -> str:
+    """Same normalization that the API promises for TAGS: ignores case, punctuation and spacing but keeps letters and digits of any script.
+    Tags made of punctuation only keep their case-folded spelling so that they never share a key with unrelated tags"""
+    tag = (tag or "").casefold()
+    return re.sub(r"[\W_]+", "", tag) or tag.strip()
+
+class TagCatalog:
+    """Canonicalization table from normalized tag keys to the exact spellings found in each tag field, so that tag filters are exact (indexable) matches. 
+    Like the source registry it is refreshed incrementally. Each refresh only reads the `max_size` most used tags of the beans collected since the last one 
+    (the last `window` days on the first load) and the table keeps the `max_size` most recently seen keys, so neither the query nor the memory is unbounded."""
+    def __init__(self, fields: list[str], max_size: int, window: int):
+        self.fields = fields
+        self.max_size = max_size
+        self.window = window
+        self._table: OrderedDict[str, dict[str, set]] = OrderedDict()
+        self._collected_since = None
+        self._lock = threading.Lock()
+
+    def _top_tags(self, field: str, since) -> list[str]:
+        pipeline = [
+            {"$match": {K_COLLECTED: {"$gt": since}}},
+            {"$unwind": "$"+field},
+            {"$group": {"_id": "$"+field, "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+            {"$limit": self.max_size}
+        ]
+        return [row["_id"] for row in db.beanstore.aggregate(pipeline, allowDiskUse=True)]
+
+    def refresh(self):
+        collected = _latest_collected()
+        since = self._collected_since or ndays_ago(self.window)
+        for field in self.fields:
+            tags = self._top_tags(field, since)
+            with self._lock:
+                for tag in tags:
+                    key = canonical_tag(tag) if isinstance(tag, str) else None
+                    if not key: continue
+                    self._table.setdefault(key, {}).setdefault(field, set()).add(tag)
+                    self._table.move_to_end(key)
+                while len(self._table) > self.max_size: self._table.popitem(last=False)
+        self._collected_since = collected
+        return self
+
+    def lookup(self, tags: list[str]) -> dict[str, list[str]]:
+        """Exact spellings per field. Tags that are not in the catalog yet are matched as given in every field"""
+        spellings = {}
+        with self._lock:
+            for tag in tags:
+                entry = self._table.get(canonical_tag(tag))
+                for field in self.fields:
+                    values = (entry.get(field) or ()) if entry else (tag,)
+                    if values: spellings.setdefault(field, set()).update(values)
+        return {field: sorted(values) for field, values in spellings.items()}
+
+    def __len__(self):
+        return len(self._table)
+
+tag_catalog = TagCatalog([K_ENTITIES, K_REGIONS, K_CATEGORIES], config.cache.tag_catalog_size, MAX_WINDOW)
+on_data_refresh(lambda: run_in_background(tag_catalog.refresh))
+
+class SourceRegistry:
+    """Sorted catalog of all source ids. After the first load it only looks at sources of beans collected since the last refresh."""
+    def __init__(self):
+        self._keys = [] # lower-cased ids kept sorted for prefix lookups
+        self._sources = []
+        self._listed: dict[str, str] = {} # lower-cased id -> the spelling that is listed, ids that only differ in case are listed once
+        self._canonical_ids: dict[str, set] = {}
+        self._collected_since = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        collected = _latest_collected()
+        sources = db.beanstore.distinct(K_SOURCE, {K_COLLECTED: {"$gt": self._collected_since}} if self._collected_since else {})
+        with self._lock:
+            for source in sources:
+                if not source: continue
+                key = canonical_tag(source)
+                if key: self._canonical_ids.setdefault(key, set()).add(source)
+                lowered = source.lower()
+                if lowered in self._listed: continue
+                self._listed[lowered] = source
+                index = bisect.bisect_left(self._keys, lowered)
+                self._keys.insert(index, lowered)
+                self._sources.insert(index, source)
+            self._collected_since = collected
+        return self
+
+    def search(self, prefix: str, limit: int) -> list[str]:
+        prefix = (prefix or "").lower()
+        with self._lock:
+            start = bisect.bisect_left(self._keys, prefix)
+            end = bisect.bisect_left(self._keys, prefix+"\uffff", lo=start, hi=min(start+limit, len(self._keys)))
+            return self._sources[start:end]
+
+    def resolve(self, sources: list[str]) -> list[str]:
+        """Exact source ids that share the normalized key of any of the given sources. The given spellings are kept as well since shared-in sources are not in the catalog"""
+        ids = set(sources)
+        with self._lock:
+            for source in sources: ids.update(self._canonical_ids.get(canonical_tag(source), ()))
+        return sorted(ids)
+
+    def __len__(self):
+        return len(self._sources)
+
+source_registry = SourceRegistry()
+on_data_refresh(lambda: run_in_background(source_registry.refresh))
+
+@traced
+def search_sources(prefix: str, limit: int) -> list[str]:
+    return source_registry.search(prefix, limit)
+
+_body_cache = TTLCache(max_size=BEAN_BODY_CACHE_SIZE, ttl=ONE_DAY)
+
+def _set_body(bean: Bean, body: Bean):
+    bean.entities = body.entities
+    bean.author = body.author
+    bean.summary = body.summary
     return bean
 
+def get_cached_bean_body(bean: Bean) -> Bean|None:
+    """Fills in the bean's summary fields from the process-wide body cache. Returns None on a miss"""
+    body = _body_cache.get(bean.url)
+    return _set_body(bean, body) if body else None
+
+@traced
+@circuit_guarded
+def prefetch_bean_bodies(beans: list[Bean]):
+    """Loads the summary fields of all the given beans that are not in the body cache yet in one query"""
+    urls = [bean.url for bean in beans if _body_cache.get(bean.url) is None]
+    if not urls: return
+    for body in (db.query_beans(filter={K_URL: {"$in": urls}}, sort_by=None, skip=0, limit=len(urls), project=BEAN_SUMMARY_FIELDS) or []):
+        _body_cache.put(body.url, BeanHeader.from_bean(body))
+
+@traced
+def load_bean_body(bean: Bean):
+    body = _body_cache.get(bean.url)
+    set_attribute("cache.hit", "fresh" if body else "miss")
+    if not body: 
+        body = db.get_bean(url=bean.url, project=BEAN_SUMMARY_FIELDS)
+        if body: body = _body_cache.put(bean.url, BeanHeader.from_bean(body))
+    return _set_body(bean, body)
+
 # def get_generated_bean(url: str):
 #     bean = db.beanstore.find_one(filter={K_ID: url, K_KIND: GENERATED}, projection={K_EMBEDDING: 0, K_CONTENT: 0})
 #     if bean: return GeneratedBean(**bean)
 
-@cached(max_size=CACHE_SIZE, ttl=ONE_HOUR)
+@traced
+@swr_cached(max_size=CACHE_SIZE, ttl=ONE_HOUR)
 def get_beans_for_home(kind: str, tags: str|list[str], sources: str|list[str], last_ndays: int, sort_by, start: int, limit: int):
     """get one bean per cluster and per source"""
     # filter = create_filter(kind, tags, sources, None, last_ndays, None)
-    return db.query_aggregated_beans(
+    return _compact(db.query_aggregated_beans(
         kind=kind,
         created=ndays_ago(last_ndays),
         entities=to_list(tags),
@@ -70,9 +272,10 @@ def get_beans_for_home(kind: str, tags: str|list[str], sources: str|list[str], l
         limit=limit,
         offset=start,
         columns=BEAN_HEADER_FIELDS
-    )
+    ))
 
-@cached(max_size=CACHE_SIZE, ttl=HALF_HOUR)
+@traced
+@swr_cached(max_size=CACHE_SIZE, ttl=HALF_HOUR, key=canonical_filter_key)
 def get_beans_for_stored_page(page: Page, kind: str, tags: str|list[str], last_ndays: int, sort_by, start: int, limit: int):
     filter=create_filter(
         kind = kind, 
@@ -83,63 +286,131 @@ def get_beans_for_stored_page(page: Page, kind: str, tags: str|list[str], last_n
         updated_in_last_ndays = None
     )
     # if the barista is primarily based on specific urls, then just search for those
-    if page.query_urls: return db.query_beans(filter=filter, sort_by=sort_by, skip=start, limit=limit, project=BEAN_HEADER_FIELDS)
-    if page.query_embedding: return db.vector_search_beans(embedding=page.query_embedding, similarity_score=page.query_distance or config.filters.page.default_accuracy, filter=filter, group_by=K_CLUSTER_ID, sort_by=sort_by, skip=start, limit=limit, project=BEAN_HEADER_FIELDS)
-    if page.query_tags or page.query_sources: return db.query_beans(filter=filter, group_by=K_CLUSTER_ID, sort_by=sort_by, skip=start, limit=limit, project=BEAN_HEADER_FIELDS)   
+    if page.query_urls: return _compact(db.query_beans(filter=filter, sort_by=sort_by, skip=start, limit=limit, project=BEAN_HEADER_FIELDS))
+    if page.query_embedding is not None: return _compact(db.vector_search_beans(embedding=_query_vector(page), similarity_score=page.query_distance or config.filters.page.default_accuracy, filter=filter, group_by=K_CLUSTER_ID, sort_by=sort_by, skip=start, limit=limit, project=BEAN_HEADER_FIELDS))
+    if page.query_tags or page.query_sources: return _compact(db.query_beans(filter=filter, group_by=K_CLUSTER_ID, sort_by=sort_by, skip=start, limit=limit, project=BEAN_HEADER_FIELDS))
 
   
 
 # @cached(max_size=CACHE_SIZE, ttl=HALF_HOUR)
+@traced
+@circuit_guarded
 def get_beans_for_custom_page(kind: str, tags: str|list[str]|list[list[str]], sources: str|list[str], last_ndays: int, sort_by, start: int, limit: int):
     """Searches and looks for news articles, social media posts, blog articles that match user interest, topic or query represented by `topic`."""  
     filter=create_filter(kind, tags, sources, None, last_ndays, None)
-    return db.query_beans(filter=filter, group_by=K_CLUSTER_ID, sort_by=sort_by, skip=start, limit=limit, project=BEAN_HEADER_FIELDS)
+    return _compact(db.query_beans(filter=filter, group_by=K_CLUSTER_ID, sort_by=sort_by, skip=start, limit=limit, project=BEAN_HEADER_FIELDS))
 
-# @cached(max_size=CACHE_SIZE, ttl=HALF_HOUR)
 def search_beans(query: str, accuracy: float, kind: str, tags: str|list[str]|list[list[str]], sources: str|list[str], last_ndays: int, start: int, limit: int):
     """Searches and looks for news articles, social media posts, blog articles that match user interest, topic or query represented by `topic`."""  
+    return search_beans_with_count(query, accuracy, kind, tags, sources, last_ndays, start, limit)[0]
+
+@traced
+def search_beans_with_count(query: str, accuracy: float, kind: str, tags: str|list[str]|list[list[str]], sources: str|list[str], last_ndays: int, start: int, limit: int) -> tuple[list[Bean], int]:
+    """Returns a page of search results along with the total number of matches (capped at MAX_LIMIT) from one matching pass"""
+    matches = _search_bean_matches(query, accuracy, kind, tags, sources, last_ndays) or ()
+    return list(matches[start:start+limit]), len(matches)
+
+@traced
+def get_similar_beans(bean: Bean, kind: str|list[str], tags: str|list[str]|list[list[str]], sources: str|list[str], last_ndays: int, sort_by, start: int, limit: int):
+    matches = _similar_bean_matches(bean, kind, tags, sources, last_ndays, sort_by) or ()
+    return list(matches[start:start+limit])
+
+@traced
+@swr_cached(max_size=CACHE_SIZE, ttl=ONE_HOUR, key=canonical_filter_key)
+def _search_bean_matches(query: str, accuracy: float, kind: str, tags: str|list[str]|list[list[str]], sources: str|list[str], last_ndays: int) -> tuple[Bean]:
     filter=create_filter(kind, tags, sources, None, last_ndays, None)
     accuracy = accuracy or config.filters.page.default_accuracy
-    # if query: return db.vector_search_beans(embedding=_embed(query), similarity_score=accuracy, filter=filter, skip=start, limit=limit, project=BEAN_HEADER_FIELDS)    
-    if query: return db.text_search_beans(query=query, filter=filter, skip=start, limit=limit, project=BEAN_HEADER_FIELDS)
+    # if query: return tuple(db.vector_search_beans(embedding=_embed(query), similarity_score=accuracy, filter=filter, skip=0, limit=MAX_LIMIT, project=BEAN_HEADER_FIELDS) or [])
+    if query: return _compact(tuple(db.text_search_beans(query=query, filter=filter, skip=0, limit=MAX_LIMIT, project=BEAN_HEADER_FIELDS) or []))
+    return tuple()
 
-# @cached(max_size=CACHE_SIZE, ttl=FOUR_HOURS)
-def get_similar_beans(bean: Bean, kind: str|list[str], tags: str|list[str]|list[list[str]], sources: str|list[str], last_ndays: int, sort_by, start: int, limit: int):
+@traced
+@swr_cached(max_size=CACHE_SIZE, ttl=FOUR_HOURS, key=canonical_filter_key)
+def _similar_bean_matches(bean: Bean, kind: str|list[str], tags: str|list[str]|list[list[str]], sources: str|list[str], last_ndays: int, sort_by = None) -> tuple[Bean]:
     filter=create_filter(kind, tags, sources, None, last_ndays, None)
     accuracy = config.filters.page.default_accuracy
-    if bean.embedding: return db.vector_search_beans(bean.embedding, accuracy, filter, None, sort_by, start, limit, BEAN_HEADER_FIELDS)
-    else: return db.vector_search_similar_beans(bean.url, accuracy, filter, None, start, limit, BEAN_HEADER_FIELDS)
+    if bean.embedding: return _compact(tuple(db.vector_search_beans(bean.embedding, accuracy, filter, None, sort_by, 0, MAX_LIMIT, BEAN_HEADER_FIELDS) or []))
+    else: return _compact(tuple(db.vector_search_similar_beans(bean.url, accuracy, filter, None, 0, MAX_LIMIT, BEAN_HEADER_FIELDS) or []))
 
+@traced
+@circuit_guarded
 def get_beans_in_cluster(id: str, kind: str|list[str], tags: str|list[str]|list[list[str]], sources: str|list[str], last_ndays: int, start: int, limit: int):
     filter = create_filter(kind, tags, sources, None, last_ndays, None)
-    return db.query_beans_in_cluster(id=id, filter=filter, sort_by=None, skip=start, limit=limit, project={**BEAN_HEADER_FIELDS, **BEAN_SUMMARY_FIELDS}) 
+    return _compact(db.query_beans_in_cluster(id=id, filter=filter, sort_by=None, skip=start, limit=limit, project={**BEAN_HEADER_FIELDS, **BEAN_SUMMARY_FIELDS}))
+
+_cluster_cache = TTLCache(max_size=CLUSTER_CACHE_SIZE, ttl=FOUR_HOURS)
+on_data_refresh(_cluster_cache.clear)
+
+@traced
+@circuit_guarded
+def load_clusters(beans: list[Bean], limit: int):
+    """Fetches the top members of the clusters of all the given beans in one query and caches them by cluster id"""
+    cluster_ids = list({
+        bean.cluster_id for bean in beans 
+        if bean.cluster_id and bean.cluster_size != 1 and _cluster_cache.get(bean.cluster_id) is None
+    })
+    if not cluster_ids: return
+    
+    groups = {cluster_id: [] for cluster_id in cluster_ids}
+    for group in db.beanstore.aggregate([
+        {"$match": {K_CLUSTER_ID: {"$in": cluster_ids}}},
+        {"$sort": {K_CREATED: -1}},
+        {"$project": {field: 1 for field in CLUSTER_MEMBER_FIELDS}},
+        {"$group": {"_id": "$"+K_CLUSTER_ID, "members": {"$push": "$$ROOT"}}},
+        # one extra since the bean itself is a member of its cluster
+        {"$project": {"members": {"$slice": ["$members", limit+1]}}} 
+    ]):
+        groups[group["_id"]] = [BeanHeader.from_row(member) for member in group["members"]]
+    for cluster_id, members in groups.items():
+        _cluster_cache.put(cluster_id, members)
+        # members come with their summaries so they can go into the body cache as well
+        for member in members: _body_cache.put(member.url, member)
 
-@cached(max_size=CACHE_SIZE, ttl=FOUR_HOURS)
+def get_cached_related_beans(bean: Bean, limit: int) -> list[Bean]|None:
+    """Returns the other members of the bean's cluster from the cluster cache or None if the cluster has not been loaded"""
+    members = _cluster_cache.get(bean.cluster_id) if bean.cluster_id else None
+    if members is None: return None
+    return [member for member in members if member.url != bean.url][:limit]
+
+def _latest_collected():
+    latest = db.beanstore.find_one(filter={}, projection={K_COLLECTED: 1}, sort=[(K_COLLECTED, -1)])
+    return latest.get(K_COLLECTED) if latest else None
+
+async def watch_for_new_beans(interval: int):
+    """Polls the beansack for newly collected beans and notifies the data refresh listeners when there are any"""
+    last_collected = None
+    while True:
+        try:
+            collected = await lanes.cheap.run(_latest_collected)
+            if last_collected and collected != last_collected: notify_data_refresh()
+            last_collected = collected
+        except Exception as err:
+            log("watch_for_new_beans_error", error=str(err))
+        await asyncio.sleep(interval)
+
+@traced
+@swr_cached(max_size=CACHE_SIZE, ttl=FOUR_HOURS, key=canonical_filter_key)
 def count_generated_beans(page: Page, tags, last_ndays: int, limit: int):
     filter=create_filter_for_generated_bean(page, tags, last_ndays)
-    if page and page.query_embedding: return db.count_vector_search_beans(
-        embedding=page.query_embedding, 
+    if page and page.query_embedding is not None: return db.count_vector_search_beans(
+        embedding=_query_vector(page), 
         similarity_score=(1 - page.query_distance) if page.query_distance else config.filters.page.default_accuracy, 
         filter=filter, limit=limit
     )
     return db.count_beans(filter=filter, limit=limit)  
 
-# @cached(max_size=CACHE_SIZE, ttl=ONE_HOUR)
+# NOTE: the counts below are approximate. they come from the same capped matching pass that serves the pages 
+@traced
 def count_search_beans(query: str, accuracy: float, kind: str, tags: str|list[str]|list[list[str]], sources: str|list[str], last_ndays: int, limit: int) -> int:
-    filter=create_filter(kind, tags, sources, None, last_ndays, None)
-    accuracy = accuracy or config.filters.page.default_accuracy
-    # if query: return db.count_vector_search_beans(embedding=_embed(query), similarity_score=accuracy, filter=filter, limit=limit)  
-    if query: return db.count_text_search_beans(query=query, filter=filter, limit=limit)
-    return 0
+    return min(len(_search_bean_matches(query, accuracy, kind, tags, sources, last_ndays) or ()), limit)
 
-@cached(max_size=CACHE_SIZE, ttl=FOUR_HOURS)
-def count_similar_beans(bean: Bean, kind: str|list[str], tags: str|list[str]|list[list[str]], sources: str|list[str], last_ndays: int, limit: int):
-    filter=create_filter(kind, tags, sources, None, last_ndays, None)
-    accuracy = config.filters.page.default_accuracy
-    if bean.embedding: return db.count_vector_search_beans(bean.embedding, accuracy, filter, None, limit)
-    else: return db.count_vector_search_similar_beans(bean.url, accuracy, filter=filter, group_by=None, limit=limit)
+@traced
+def count_similar_beans(bean: Bean, kind: str|list[str], tags: str|list[str]|list[list[str]], sources: str|list[str], last_ndays: int, sort_by, limit: int):
+    """Counts from the same cached matching pass as `get_similar_beans` so `sort_by` has to be passed the same way"""
+    return min(len(_similar_bean_matches(bean, kind, tags, sources, last_ndays, sort_by) or ()), limit)
 
-@cached(max_size=CACHE_SIZE, ttl=FOUR_HOURS)
+@traced
+@swr_cached(max_size=CACHE_SIZE, ttl=FOUR_HOURS, key=canonical_filter_key)
 def get_filter_tags_for_stored_page(page: Page, last_ndays: int, start: int, limit: int):
     filter=create_filter(
         kind = None,
@@ -149,16 +420,19 @@ def get_filter_tags_for_stored_page(page: Page, last_ndays: int, start: int, lim
         created_in_last_ndays = last_ndays, 
         updated_in_last_ndays = None        
     )
-    if page.query_embedding: return db.vector_search_tags(page.query_embedding, page.query_distance or config.filters.page.default_accuracy, filter, tag_field = K_ENTITIES, remove_tags=page.query_tags, skip=start, limit=limit)
+    if page.query_embedding is not None: return db.vector_search_tags(_query_vector(page), page.query_distance or config.filters.page.default_accuracy, filter, tag_field = K_ENTITIES, remove_tags=page.query_tags, skip=start, limit=limit)
     if page.query_urls or page.query_tags or page.query_sources: return db.query_tags(filter, tag_field = K_ENTITIES, remove_tags=page.query_tags, skip=start, limit=limit)
 
-@cached(max_size=CACHE_SIZE, ttl=HALF_HOUR)
+@traced
+@swr_cached(max_size=CACHE_SIZE, ttl=HALF_HOUR)
 def get_filter_tags_for_custom_page(tags: str|list[str]|list[list[str]], sources: str|list[str], last_ndays: int, start: int, limit: int):
     """Searches and looks for news articles, social media posts, blog articles that match user interest, topic or query represented by `topic`."""  
     filter=create_filter(None, tags, sources, None, last_ndays, None)
     return db.query_tags(bean_filter=filter, tag_field=K_ENTITIES, remove_tags=tags, skip=start, limit=limit)
 
 # @cached(max_size=CACHE_SIZE, ttl=ONE_HOUR)
+@traced
+@circuit_guarded
 def search_filter_tags(query: str, accuracy: float, tags: str|list[str]|list[list[str]], sources: str|list[str], last_ndays: int, start: int, limit: int) -> list[Bean]:
     filter=create_filter(None, tags, sources, None, last_ndays, None)
     accuracy = accuracy or config.filters.page.default_accuracy
@@ -182,15 +456,68 @@ PAGE_MINIMAL_FIELDS = {K_ID: 1, K_TITLE: 1}
 PAGE_DEFAULT_FIELDS = {K_ID: 1, K_TITLE: 1, K_DESCRIPTION: 1, "public": 1, "owner": 1}
 PAGE_EMBEDDING_FIELDS = {K_ID: 1, K_EMBEDDING: 1}
 
-@cached(max_size=CACHE_SIZE, ttl=ONE_HOUR)
+PAGE_RECORD_FIELDS = {
+    K_ID: 1, K_TITLE: 1, K_DESCRIPTION: 1, "public": 1, "owner": 1, 
+    "query_urls": 1, "query_tags": 1, "query_sources": 1, "query_embedding": 1, "query_distance": 1
+}
+
+@traced
+@swr_cached(max_size=CACHE_SIZE, ttl=ONE_HOUR, key=lambda id: id, cache_none=False)
 def get_page(id: str) -> Page|None:
-    return db.get_page(id, PAGE_DEFAULT_FIELDS)
+    """Compact page record shared by routing and the feeds. The query embedding is held as a float32 array"""
+    page = db.get_page(id, PAGE_RECORD_FIELDS)
+    if page and page.query_embedding is not None: page.query_embedding = np.asarray(page.query_embedding, dtype=np.float32)
+    return page
+
+_page_listeners = []
+
+def on_page_invalidated(func):
+    """Registers `func(page_id)` to be called whenever a page is invalidated. Use it to drop anything derived from the page's query"""
+    _page_listeners.append(func)
+    return func
+
+def invalidate_page(id: str):
+    """Call this whenever a page is published, unpublished or updated"""
+    get_page.cache.invalidate(id)
+    for func in _page_listeners:
+        try: func(id)
+        except Exception as err: log("page_listener_error", page_id=id, error=str(err))
 
-@cached(max_size=CACHE_SIZE, ttl=FOUR_HOURS)
+_query_vector = lambda page: page.query_embedding.tolist() if isinstance(page.query_embedding, np.ndarray) else page.query_embedding
+
+@traced
+@swr_cached(max_size=CACHE_SIZE, ttl=FOUR_HOURS)
 def get_pages(ids: list[str]) -> list[Page]:
     return db.get_pages(ids, PAGE_DEFAULT_FIELDS)
 
-@cached(max_size=CACHE_SIZE, ttl=FOUR_HOURS)
+_user_cache = TTLCache(max_size=USER_CACHE_SIZE, ttl=config.cache.user_ttl)
+
+@traced
+def get_user(email: str) -> User|None:
+    user = _user_cache.get(email)
+    set_attribute("cache.hit", "fresh" if user else "miss")
+    if not user:
+        user = db.get_user(email)
+        if user: _user_cache.put(email, user)
+    return user
+
+def invalidate_user(email: str):
+    """Call this whenever the user follows or unfollows a page, (re)registers or gets deleted"""
+    _user_cache.invalidate(email)
+    _following_pages_cache.invalidate(email)
+    _bookmarks_cache.invalidate(email)
+
+_following_pages_cache = TTLCache(max_size=USER_CACHE_SIZE, ttl=ONE_HOUR)
+
+@traced
+def get_following_pages(user: User) -> list[Page]:
+    pages = _following_pages_cache.get(user.email)
+    set_attribute("cache.hit", "miss" if pages is None else "fresh")
+    if pages is None: pages = _following_pages_cache.put(user.email, db.get_following_pages(user, PAGE_DEFAULT_FIELDS) or [])
+    return pages
+
+@traced
+@swr_cached(max_size=CACHE_SIZE, ttl=FOUR_HOURS, key=lambda context: context.page_id)
 def get_page_suggestions(context: Context):
     pages = None
     if context.is_stored_page: pages = db.get_related_pages(context.page.id, PAGE_MINIMAL_FIELDS)
@@ -198,19 +525,48 @@ def get_page_suggestions(context: Context):
     if not pages: pages = db.sample_pages(5, PAGE_MINIMAL_FIELDS)
     return pages
 
-@cached(max_size=CACHE_SIZE, ttl=HALF_HOUR)
+@traced
+@swr_cached(max_size=CACHE_SIZE, ttl=HALF_HOUR)
 def search_pages(query: str):
     return db.search_pages(query, PAGE_DEFAULT_FIELDS)
 
+# a user's bookmarks are the urls of their /pages/{email} page
+BOOKMARK_FIELDS = {K_ID: 1, "query_urls": 1}
+_bookmarks_cache = TTLCache(max_size=USER_CACHE_SIZE, ttl=ONE_HOUR)
+
+@traced
+def get_bookmarks(user: User) -> set[str]:
+    """All the urls the user bookmarked. Loaded in one query and then kept in sync by `bookmark` and `unbookmark`"""
+    bookmarks = _bookmarks_cache.get(user.email)
+    set_attribute("cache.hit", "miss" if bookmarks is None else "fresh")
+    if bookmarks is None:
+        page = db.get_page(user.email, BOOKMARK_FIELDS)
+        bookmarks = _bookmarks_cache.put(user.email, set(page.query_urls or []) if page else set())
+    return bookmarks
+
 def is_bookmarked(context: Context, url: str):
     if not context.is_user_registered: return False
-    return db.is_bookmarked(context.user, url)
+    return url in get_bookmarks(context.user)
+
+def bookmark(context: Context, url: str):
+    db.bookmark(context.user, url)
+    get_bookmarks(context.user).add(url)
+    invalidate_page(context.user.email)
+
+def unbookmark(context: Context, url: str):
+    db.unbookmark(context.user, url)
+    get_bookmarks(context.user).discard(url)
+    invalidate_page(context.user.email)
+
+def _make_tags_filter(tags: str|list[str]) -> dict|None:
+    """None when there is nothing to match on, since mongo rejects an empty $or"""
+    conditions = [{field: {"$in": values}} for field, values in tag_catalog.lookup([tag for tag in to_list(tags) if tag]).items()]
+    if not conditions: return None
+    return conditions[0] if len(conditions) == 1 else {"$or": conditions}
 
-_make_tags_filter = lambda tags:  [
-    {K_ENTITIES: field_value(tags)},
-    {K_REGIONS: field_value(tags)},
-    {K_CATEGORIES: field_value(tags)}
-] 
+def _make_sources_filter(sources: str|list[str]) -> dict:
+    ids = source_registry.resolve(to_list(sources))
+    return {"$or": [{K_SOURCE: {"$in": ids}}, {K_SHARED_IN: {"$in": ids}}]}
 
 def create_filter(
     kind: str|list[str],
@@ -220,21 +576,20 @@ def create_filter(
     created_in_last_ndays: int,
     updated_in_last_ndays: int
 ) -> dict:   
-    filter = {}
+    filter, conditions = {}, []
     if kind: filter[K_KIND] = lower_case(kind)
-    if sources: filter["$or"] = [
-        {K_SOURCE: case_insensitive(sources)},
-        {K_SHARED_IN: case_insensitive(sources)}
-    ]
+    if sources: conditions.append(_make_sources_filter(sources))
     if urls: filter[K_URL] = field_value(urls)
     if created_in_last_ndays: filter.update(created_in(created_in_last_ndays))
     if updated_in_last_ndays: filter.update(updated_in(updated_in_last_ndays))
 
-    if isinstance(tags, str): filter["$or"] = _make_tags_filter(tags)
+    if isinstance(tags, str): conditions.append(_make_tags_filter(tags))
     elif isinstance(tags, list):
-        if all(isinstance(tag, str) for tag in tags): filter["$or"] = _make_tags_filter(tags)
-        elif any(isinstance(tag, list) for tag in tags): filter["$and"] = [{"$or": _make_tags_filter(tag)} for tag in tags if tag] 
+        if all(isinstance(tag, str) for tag in tags): conditions.append(_make_tags_filter(tags))
+        elif any(isinstance(tag, list) for tag in tags): conditions.extend(_make_tags_filter(tag) for tag in tags if tag)
     
+    conditions = [condition for condition in conditions if condition]
+    if conditions: filter["$and"] = conditions
     return filter
 
 def create_filter_for_generated_bean(
@@ -243,11 +598,13 @@ def create_filter_for_generated_bean(
     created_in_last_ndays: int
 ) -> dict:   
     filter = {K_KIND: OPED}    
-    if tags: filter["$or"] = _make_tags_filter(tags)
+    tags_filter = _make_tags_filter(tags) if tags else None
+    if tags_filter: filter["$and"] = [tags_filter]
     if page and page.query_tags: filter[K_ENTITIES] = lower_case(page.query_tags)
     if created_in_last_ndays: filter.update(created_in(created_in_last_ndays))
     return filter
 
+@traced
 @cached(max_size=CACHE_SIZE, ttl=ONE_HOUR)
 def _embed(query: str):
     return embedder.embed_query(query)
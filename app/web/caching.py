@@ -0,0 +1,211 @@
+import time
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from app.shared.env import *
+from app.shared.tracing import set_attribute
+
+class TTLCache:
+    """Thread-safe LRU cache that remembers when each entry was stored so that callers can decide how stale is too stale."""
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def peek(self, key):
+        """Returns (value, age in seconds) regardless of freshness or None if the key was never stored or got evicted."""
+        with self._lock:
+            if key not in self._items: return None
+            self._items.move_to_end(key)
+            value, stored_at = self._items[key]
+        return value, time.time() - stored_at
+
+    def get(self, key, default=None):
+        entry = self.peek(key)
+        return entry[0] if entry and entry[1] < self.ttl else default
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = (value, time.time())
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+class CircuitOpenError(Exception):
+    """Raised by `CircuitBreaker.call` instead of calling through while the breaker is open"""
+
+class CircuitBreaker:
+    """Trips open when too many of the recent calls either failed or took longer than `slow_call` seconds.
+    While open, calls fail fast and callers are expected to serve stale values only. After `cooldown` seconds the breaker is half-open: 
+    exactly one call is let through as a probe while the rest keep failing fast. A healthy probe closes the breaker, an unhealthy one reopens it."""
+    def __init__(self, window: int, min_calls: int, max_failure_rate: float, slow_call: float, cooldown: float):
+        self.min_calls = min_calls
+        self.max_failure_rate = max_failure_rate
+        self.slow_call = slow_call
+        self.cooldown = cooldown
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None: return "closed"
+        return "open" if self._probing or (time.time() - self._opened_at) < self.cooldown else "half-open"
+
+    @property
+    def is_open(self) -> bool:
+        """True when a call made right now would be rejected"""
+        return self.state == "open"
+
+    def _admit(self) -> bool:
+        """Returns whether the call is the half-open probe. Raises `CircuitOpenError` if the call may not go through"""
+        with self._lock:
+            if self._opened_at is None: return False
+            if self._probing or (time.time() - self._opened_at) < self.cooldown: raise CircuitOpenError()
+            self._probing = True
+            return True
+
+    def record(self, success: bool, latency: float, probe: bool = False):
+        healthy = success and latency < self.slow_call
+        with self._lock:
+            if probe:
+                self._probing = False
+                self._opened_at = None if healthy else time.time()
+                if healthy: log("circuit_closed")
+                return
+            # calls that were already in flight when the breaker opened say nothing about the recovery
+            if self._opened_at is not None: return
+            self._outcomes.append(healthy)
+            if len(self._outcomes) < self.min_calls: return
+            failure_rate = self._outcomes.count(False) / len(self._outcomes)
+            if failure_rate >= self.max_failure_rate:
+                self._opened_at = time.time()
+                self._outcomes.clear()
+                log("circuit_opened", failure_rate=failure_rate)
+
+    def call(self, func, *args, **kwargs):
+        probe = self._admit()
+        start = time.time()
+        try:
+            result = func(*args, **kwargs)
+            self.record(True, time.time() - start, probe)
+            return result
+        except Exception:
+            self.record(False, time.time() - start, probe)
+            raise
+
+db_breaker = CircuitBreaker(
+    window=config.cache.breaker.window,
+    min_calls=config.cache.breaker.min_calls,
+    max_failure_rate=config.cache.breaker.max_failure_rate,
+    slow_call=config.cache.breaker.slow_call,
+    cooldown=config.cache.breaker.cooldown
+)
+# revalidation gets its own workers so that slow refreshes cannot hold up the other background work and vice versa
+_revalidator = ThreadPoolExecutor(max_workers=config.cache.refresh_workers, thread_name_prefix="cache-revalidate")
+_background = ThreadPoolExecutor(max_workers=config.cache.background_workers, thread_name_prefix="background")
+
+_refresh_listeners = []
+
+def on_data_refresh(func):
+    """Registers `func` to be called whenever new beans land in the beansack. Use it to drop caches that are keyed by data rather than by time"""
+    _refresh_listeners.append(func)
+    return func
+
+def notify_data_refresh():
+    for func in _refresh_listeners:
+        try: func()
+        except Exception as err: log("data_refresh_listener_error", function=getattr(func, "__name__", str(func)), error=str(err))
+
+def run_in_background(func, *args, **kwargs):
+    """Runs a blocking function on the cache refresh workers so that it never holds up the event loop"""
+    return _background.submit(func, *args, **kwargs)
+
+def make_key(args: tuple, kwargs: dict):
+    key = (args, tuple(sorted(kwargs.items())))
+    try:
+        hash(key)
+        return key
+    except TypeError:
+        return repr(key)
+
+def swr_cached(max_size: int, ttl: int, max_stale: int = None, key = None, cache_none: bool = True):
+    """Memoizes a DB read path with stale-while-revalidate semantics.
+    Fresh values are returned as-is. Values past `ttl` but within `max_stale` are returned immediately while a background refresh runs.
+    When `db_breaker` is open no refresh or fetch is attempted and only values within the staleness bound are served.
+    While it is half-open the first miss or refresh becomes its probe.
+    `key` optionally maps the call arguments to the cache key, e.g. to canonicalize equivalent filters.
+    With `cache_none` off a None result is not remembered so that the next call asks the DB again, e.g. for records that other processes create."""
+    max_stale = config.cache.max_stale if max_stale is None else max_stale
+    key_func = key or (lambda *args, **kwargs: make_key(args, kwargs))
+
+    def decorator(func):
+        cache = TTLCache(max_size, ttl)
+        refreshing = set()
+        lock = threading.Lock()
+
+        def store(key, value):
+            if value is None and not cache_none: cache.invalidate(key)
+            else: cache.put(key, value)
+            return value
+
+        def refresh(key, args, kwargs):
+            try: store(key, db_breaker.call(func, *args, **kwargs))
+            except CircuitOpenError: pass
+            except Exception as err: log("cache_refresh_error", function=func.__name__, error=str(err))
+            finally:
+                with lock: refreshing.discard(key)
+
+        def schedule_refresh(key, args, kwargs):
+            with lock:
+                if key in refreshing: return
+                refreshing.add(key)
+            _revalidator.submit(refresh, key, args, kwargs)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = key_func(*args, **kwargs)
+            entry = cache.peek(key)
+            if entry:
+                value, age = entry
+                if age < ttl: 
+                    set_attribute("cache.hit", "fresh")
+                    return value
+                if age < ttl + max_stale:
+                    set_attribute("cache.hit", "stale")
+                    if not db_breaker.is_open: schedule_refresh(key, args, kwargs)
+                    return value
+            set_attribute("cache.hit", "miss")
+            try: return store(key, db_breaker.call(func, *args, **kwargs))
+            except CircuitOpenError:
+                log("circuit_open_miss", function=func.__name__)
+                return None
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+def circuit_guarded(func):
+    """For uncached read paths: fails fast with None while `db_breaker` is open instead of waiting on a struggling DB."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try: return db_breaker.call(func, *args, **kwargs)
+        except CircuitOpenError:
+            log("circuit_open_miss", function=func.__name__)
+            return None
+    return wrapper
@@ -3,6 +3,7 @@ from icecream import ic
 from pydantic import BaseModel
 from typing import Optional
 from pybeansack.models import Bean, Page, User
+from app.web import events
 
 
 # this is the user navigation and access context that also arbitrates RBAC
@@ -87,4 +88,4 @@ class Context(BaseModel):
         }
         if kwargs:
             extra.update(kwargs)
-        log(action, **extra)
\ No newline at end of file
+        events.emit(action, **extra)
\ No newline at end of file
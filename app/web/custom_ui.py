@@ -10,11 +10,51 @@ def groupby_date(items: list, date_field):
     flatten_date = lambda item: dt.fromtimestamp(date_field(item)).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
     return {date_val: list(group_items) for date_val, group_items in groupby(items, flatten_date)}
 
-class BindableTimeline(ui.timeline):
+# default item key: immutable values key themselves, anything else keys by its content so that changed items get re-rendered
+_content_key = lambda item: item if isinstance(item, (str, int, float, tuple)) else repr(item)
+
+class KeyedChildren:
+    """Mixin for the Bindable* components. Children are tracked by item key so that a change to `items` only inserts, removes or moves 
+    the children of the items that changed instead of clearing and rebuilding all of them."""
+    key = staticmethod(_content_key)
+    _keyed_children: dict = None
+
+    def _patch(self, items: list, render_item, key = None, container: ui.element = None):
+        key_func, container = key or self.key, container or self
+        old = self._keyed_children or {}
+        new, seen = {}, {}
+        for item in items or []:
+            # repeated keys are told apart by their occurrence so that duplicate items still get a child each
+            key = key_func(item)
+            seen[key] = seen.get(key, -1) + 1
+            new[(key, seen[key])] = item
+        for key in [key for key in old if key not in new]:
+            for element in old.pop(key): element.delete()
+        # the surviving children only need to move if their relative order changed
+        in_order = [key for key in new if key in old] == list(old)
+
+        children, position = {}, 0
+        for key, item in new.items():
+            elements = old.get(key)
+            if elements is None:
+                rendered = len(container.default_slot.children)
+                with container: render_item(item)
+                elements = container.default_slot.children[rendered:]
+                if position != rendered: 
+                    for offset, element in enumerate(elements): element.move(container, position+offset)
+            elif not in_order:
+                for offset, element in enumerate(elements):
+                    if container.default_slot.children.index(element) != position+offset: element.move(container, position+offset)
+            children[key] = list(elements)
+            position += len(elements)
+        self._keyed_children = children
+
+class BindableTimeline(KeyedChildren, ui.timeline):
     items = BindableProperty(on_change=lambda sender, value: cast(Self, sender)._render())
 
-    def __init__(self, item_render_func, items: list|dict = None, date_field = lambda x: x['date'], header_field: str = lambda x: x["name"], groupby_time: bool = False):
+    def __init__(self, item_render_func, items: list|dict = None, date_field = lambda x: x['date'], header_field: str = lambda x: x["name"], groupby_time: bool = False, key = None):
         super().__init__()
+        if key: self.key = key
         self.items = items
         self.date_field = date_field
         self.header_field = header_field
@@ -23,89 +63,190 @@ class BindableTimeline(ui.timeline):
         self._render()
     
     def _render(self):    
-        self.clear()
         items = self.items or []           
-        with self:
-            if not self.groupby_time:
-                for item in items:
-                    date = self.date_field(item)
-                    with ui.timeline_entry(
-                        title=self.header_field(item), 
-                        subtitle=(naturalday(date) if isinstance(date, (int, float)) else date)):
-                        self.render_item(item)
-            else:                
-                for date, group in groupby_date(items, self.date_field).items():
-                    with ui.timeline_entry(
-                        title=", ".join(self.header_field(item) for item in group), 
-                        subtitle=(naturalday(date) if isinstance(date, (int, float)) else date)):
-                        for item in group:
-                            self.render_item(item)
+        if not self.groupby_time: 
+            self._patch(items, self._render_entry)
+        else:
+            # a group is keyed by its date and the keys of its items, so only the groups that gained or lost items are rebuilt
+            groups = [(date, group, tuple(map(self.key, group))) for date, group in groupby_date(items, self.date_field).items()]
+            self._patch(groups, self._render_group, key=lambda group: (group[0], group[2]))
+
+    def _render_entry(self, item):
+        date = self.date_field(item)
+        with ui.timeline_entry(
+            title=self.header_field(item), 
+            subtitle=(naturalday(date) if isinstance(date, (int, float)) else date)):
+            self.render_item(item)
+
+    def _render_group(self, group):
+        date, items, _ = group
+        with ui.timeline_entry(
+            title=", ".join(self.header_field(item) for item in items), 
+            subtitle=(naturalday(date) if isinstance(date, (int, float)) else date)):
+            for item in items:
+                self.render_item(item)
 
     def bind_items_from(self, target_object, target_name: str = 'items', backward = lambda x: x) -> Self:
         bind_from(self, "items", target_object, target_name, backward)
         return self
 
-class BindableList(ui.list):
+class BindableList(KeyedChildren, ui.list):
     items = BindableProperty(on_change=lambda sender, value: cast(Self, sender)._render(value))
 
-    def __init__(self, item_render_func, items: list = None):
+    def __init__(self, item_render_func, items: list = None, key = None):
         super().__init__()
+        if key: self.key = key
         self.items = items or []
         self.render_item = item_render_func
         self._render(self.items)
     
     def _render(self, value):    
-        self.clear()    
-        with self:
-            for item in (value or []):                                    
-                self.render_item(item)
+        self._patch(value, self.render_item)
 
     def bind_items_from(self, target_object, target_name: str = 'items', backward = lambda x: x) -> Self:
         bind_from(self, "items", target_object, target_name, backward)
         return self
     
-class BindableNavigationMenu(ui.menu):
+class BindableNavigationMenu(KeyedChildren, ui.menu):
     items = BindableProperty(on_change=lambda sender, value: cast(Self, sender)._render(value))
 
-    def __init__(self, data_extraction_func, items: list = None):
+    def __init__(self, data_extraction_func, items: list = None, key = None):
         super().__init__()
+        if key: self.key = key
         self.items = items or []
         self.extract = data_extraction_func
         self._render(self.items)
     
     def _render(self, value):    
-        self.clear()    
-        with self:
-            for item in (value or []): 
-                text, target = self.extract(item)
-                ui.menu_item(text = text, on_click=target)
+        self._patch(value, self._render_item)
+
+    def _render_item(self, item):
+        text, target = self.extract(item)
+        ui.menu_item(text = text, on_click=target)
 
     def bind_items_from(self, target_object, target_name: str = 'items', backward = lambda x: x) -> Self:
         bind_from(self, "items", target_object, target_name, backward)
         return self
 
-class BindableGrid(ui.grid):
+class BindableGrid(KeyedChildren, ui.grid):
     items = BindableProperty(
         on_change=lambda sender, value: cast(Self, sender)._render(value)
     )
 
-    def __init__(self, item_render_func, items: list = None, rows: int = None, columns: int = None):     
+    def __init__(self, item_render_func, items: list = None, rows: int = None, columns: int = None, key = None):     
         super().__init__(rows = rows, columns = columns)             
+        if key: self.key = key
         self.items = items
         self.render_item = item_render_func    
         self._render(self.items)
    
     def _render(self, value):  
-        self.clear() 
-        with self:            
-            for item in (value or []):
-                self.render_item(item)
-        self.update()
+        self._patch(value, self.render_item)
 
     def bind_items_from(self, target_object, target_name: str = 'items', backward = lambda x: x) -> Self:
         bind_from(self, "items", target_object, target_name, backward)
         return self
 
+class VirtualList(ui.scroll_area):
+    """Scrollable list that keeps every item as a plain record but only materializes the items in and around the viewport.
+    Slots that scroll out of the window are recycled for the items scrolling in, so the element count stays flat no matter how long the list gets.
+    `item_height` is the estimated height of a rendered item in px. Every scroll event reports the actual height of the rendered window,
+    which is recorded per item so that the spacers follow the real layout, including cards that were expanded while in view.
+    Scroll events are throttled to one every `throttle` seconds."""
+
+    def __init__(self, item_render_func, items: list = None, key = id, item_height: int = 160, overscan: int = 4, viewport_height: int = 1200, throttle: float = 0.2):
+        super().__init__()
+        self.on("scroll", self._on_scroll, args=["verticalPosition", "verticalSize", "verticalContainerSize"], throttle=throttle)
+        self.render_item = item_render_func
+        self.key = key
+        self.item_height = item_height
+        self.overscan = overscan
+        self._items = list(items or [])
+        self._start = 0
+        self._viewport_height = viewport_height
+        self._heights = {} # key -> measured height in px
+        self._spacer_heights = (0, 0)
+        self._slots = {} # key of the rendered item -> slot element holding it
+        self._delete_handlers = []
+        with self:
+            self._top_spacer = ui.element().classes("w-full")
+            self._window = ui.column(align_items="stretch").classes("w-full")
+            self._bottom_spacer = ui.element().classes("w-full")
+        self._render()
+
+    @property
+    def items(self) -> list:
+        return self._items
+
+    def on_delete(self, handler):
+        """Registers `handler()` to run when the list is deleted, which includes the client going away"""
+        self._delete_handlers.append(handler)
+        return handler
+
+    def _handle_delete(self):
+        for handler in self._delete_handlers: handler()
+        super()._handle_delete()
+
+    def extend(self, items: list):
+        self._items.extend(items)
+        self._render()
+
+    def drop_oldest(self, count: int) -> list:
+        """Forgets the first `count` items and returns them"""
+        dropped, self._items = self._items[:count], self._items[count:]
+        for item in dropped: self._heights.pop(self.key(item), None)
+        self._start = max(self._start - len(dropped), 0)
+        self._render()
+        return dropped
+
+    def _height(self, item) -> float:
+        return self._heights.get(self.key(item), self.item_height)
+
+    def _measure(self, content_height: float):
+        # whatever the content measures beyond the spacers is the rendered window
+        rendered = list(self._slots)
+        window_height = (content_height or 0) - sum(self._spacer_heights)
+        if not rendered or window_height <= 0: return
+        for key in rendered: self._heights[key] = window_height / len(rendered)
+
+    def _on_scroll(self, e):
+        if e.args.get("verticalContainerSize"): self._viewport_height = e.args["verticalContainerSize"]
+        self._measure(e.args.get("verticalSize"))
+        position, offset, start = e.args.get("verticalPosition") or 0, 0, 0
+        for start, item in enumerate(self._items):
+            offset += self._height(item)
+            if offset > position: break
+        start = max(start - self.overscan, 0)
+        if start == self._start: return
+        self._start = start
+        self._render()
+
+    def _render(self):
+        end, height = self._start, 0
+        while end < len(self._items) and height < self._viewport_height:
+            height += self._height(self._items[end])
+            end += 1
+        end = min(end + 2*self.overscan, len(self._items))
+        visible = {self.key(item): item for item in self._items[self._start:end]}
+        # slots of items that left the window get re-rendered with the items that entered it
+        free = [slot for key, slot in self._slots.items() if key not in visible]
+        slots = {}
+        for index, (key, item) in enumerate(visible.items()):
+            slot = self._slots.get(key)
+            if slot is None:
+                if free: slot = free.pop()
+                else:
+                    with self._window: slot = ui.element().classes("w-full")
+                slot.clear()
+                with slot: self.render_item(item)
+            if self._window.default_slot.children.index(slot) != index: slot.move(self._window, index)
+            slots[key] = slot
+        for slot in free: slot.delete()
+        self._slots = slots
+        self._spacer_heights = (sum(map(self._height, self._items[:self._start])), sum(map(self._height, self._items[end:])))
+        self._top_spacer.style(f"height: {self._spacer_heights[0]}px")
+        self._bottom_spacer.style(f"height: {self._spacer_heights[1]}px")
+
 class HighlightableItem(ui.item):
     highlight = BindableProperty(
         on_change=lambda sender, value: cast(Self, sender)._render()
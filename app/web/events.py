@@ -0,0 +1,115 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+from app.shared.env import *
+from app.web import lanes, metrics
+
+# user interaction events are queued in memory and written out in batches by a background task so that logging never holds up an interaction
+
+class LogSink:
+    """Writes every event as a structured log line, which is also what ends up in the OpenTelemetry logs exporter"""
+    def write(self, events: list[dict]):
+        for event in events:
+            event = dict(event)
+            log(event.pop("action"), **event)
+
+class JsonlSink:
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, events: list[dict]):
+        with open(self.path, "a") as file:
+            file.writelines(json.dumps(event, default=str)+"\n" for event in events)
+
+class CollectionSink:
+    """Inserts the events into a mongo collection"""
+    def __init__(self, collection):
+        self.collection = collection
+
+    def write(self, events: list[dict]):
+        self.collection.insert_many([dict(event) for event in events], ordered=False)
+
+class EventPipeline:
+    """Bounded ring buffer of events drained into `sinks` in batches. When the buffer is full the oldest events are dropped rather than blocking.
+    High volume actions can be sampled through `sample_rates` and the actions in `aggregate` are additionally counted per url per minute."""
+    def __init__(self, sinks: list, capacity: int, batch_size: int, flush_interval: float, sample_rates: dict[str, float] = None, aggregate: list[str] = None, retention: int = 60):
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_rates = sample_rates or {}
+        self.aggregate = set(aggregate or [])
+        self.retention = retention
+        self._buffer = deque(maxlen=capacity)
+        self._counters = defaultdict(int) # (action, url, minute) -> count
+        self._lock = threading.Lock()
+
+    def emit(self, action: str, **fields):
+        """Never blocks and never raises"""
+        minute = int(time.time() // 60)
+        if action in self.aggregate and fields.get("url"):
+            with self._lock: self._counters[(action, fields["url"], minute)] += 1
+        if random.random() >= self.sample_rates.get(action, 1.0): 
+            metrics.increment("events_sampled_out")
+            return
+        if len(self._buffer) == self._buffer.maxlen: metrics.increment("events_dropped")
+        self._buffer.append({"action": action, "timestamp": datetime.now().isoformat(), **fields})
+
+    def counts(self, action: str, minutes: int = 60) -> dict[str, int]:
+        """Events per url over the last `minutes`, e.g. reads per url for trending"""
+        since = int(time.time() // 60) - minutes
+        totals = defaultdict(int)
+        with self._lock:
+            for (counted_action, url, minute), count in self._counters.items():
+                if counted_action == action and minute > since: totals[url] += count
+        return dict(totals)
+
+    def _prune(self):
+        oldest = int(time.time() // 60) - self.retention
+        with self._lock:
+            for key in [key for key in self._counters if key[2] <= oldest]: del self._counters[key]
+
+    def _drain(self) -> list[dict]:
+        batch = []
+        while self._buffer and len(batch) < self.batch_size:
+            batch.append(self._buffer.popleft())
+        return batch
+
+    def _write(self, batch: list[dict]):
+        for sink in self.sinks:
+            try: sink.write(batch)
+            except Exception as err: log("event_sink_error", sink=type(sink).__name__, error=str(err))
+        metrics.increment("events_written", len(batch))
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            while batch := self._drain():
+                await lanes.cheap.run(self._write, batch)
+            self._prune()
+
+    def flush(self):
+        """Writes out whatever is still buffered. Meant for shutdown"""
+        while batch := self._drain():
+            self._write(batch)
+
+    def stats(self) -> dict:
+        return {"buffered": len(self._buffer), "capacity": self._buffer.maxlen, "counters": len(self._counters)}
+
+def _create_sink(name: str):
+    if name == "jsonl": return JsonlSink(config.events.jsonl_path)
+    if name == "collection": return CollectionSink(db.beanstore.database[config.events.collection])
+    return LogSink()
+
+pipeline = EventPipeline(
+    sinks=[_create_sink(name) for name in config.events.sinks],
+    capacity=config.events.capacity,
+    batch_size=config.events.batch_size,
+    flush_interval=config.events.flush_interval,
+    sample_rates=vars(config.events.sample_rates),
+    aggregate=config.events.aggregate
+)
+emit = pipeline.emit
@@ -0,0 +1,191 @@
+import asyncio
+import threading
+from datetime import datetime
+from collections import OrderedDict, deque
+import numpy as np
+from nicegui import run
+from app.pybeansack.models import *
+from app.pybeansack.mongosack import TRENDING, LATEST
+from app.shared.utils import *
+from app.shared.env import *
+from app.shared.consts import *
+from app.web import beanops
+from app.web.caching import db_breaker, on_data_refresh, run_in_background
+
+# materialized feeds that are rebuilt in the background and served straight from memory
+HOME_FEED_LENGTH = MAX_LIMIT
+
+_home_feeds: dict[tuple, tuple] = {}
+_refresh_requested = asyncio.Event()
+on_data_refresh(_refresh_requested.set)
+
+def _home_feed_keys():
+    return [(kind, config.feeds.home_window) for kind in [None]+config.filters.page.kinds]
+
+def _build_home_feeds() -> dict[tuple, tuple]:
+    feeds = {}
+    for kind, last_ndays in _home_feed_keys():
+        beans = db_breaker.call(beanops.get_beans_for_home.__wrapped__, kind, None, None, last_ndays, None, 0, HOME_FEED_LENGTH)
+        feeds[(kind, last_ndays)] = tuple(beans or [])
+    return feeds
+
+async def refresh_home_feeds(interval: int):
+    """Rebuilds the home feed snapshots every `interval` seconds or as soon as new beans land"""
+    global _home_feeds
+    while True:
+        try:
+            # swapping the whole dict is atomic so readers see either the old or the new snapshots
+            _home_feeds = await run.io_bound(_build_home_feeds)
+            log("home_feeds_refreshed", feeds=len(_home_feeds))
+        except Exception as err:
+            log("home_feeds_refresh_error", error=str(err))
+        try: await asyncio.wait_for(_refresh_requested.wait(), timeout=interval)
+        except asyncio.TimeoutError: pass
+        _refresh_requested.clear()
+
+def get_beans_for_home(kind: str, tags: str|list[str], sources: str|list[str], last_ndays: int, sort_by, start: int, limit: int):
+    """Serves the home feed from the materialized snapshot and falls back to beanops for filtered views or pages past the snapshot.
+    NOTE: the aggregated home query does not apply `sort_by`, so the snapshots are keyed by kind and window only"""
+    feed = None if (tags or sources) else _home_feeds.get((kind, last_ndays))
+    if feed is not None and (start+limit <= len(feed) or len(feed) < HOME_FEED_LENGTH):
+        return list(feed[start:start+limit])
+    return beanops.get_beans_for_home(kind, tags, sources, last_ndays, sort_by, start, limit)
+
+STANDING_BATCH_SIZE = 1000
+MAX_STANDING_BATCHES = 100
+
+_engagement = lambda bean: (bean.comments or 0) + (bean.likes or 0) + (bean.shares or 0)
+_normalized = lambda vectors: vectors / np.clip(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-9, None)
+
+def _matches_page_filters(page: Page, bean: Bean) -> bool:
+    if page.query_sources and beanops.canonical_tag(bean.source or "") not in set(map(beanops.canonical_tag, page.query_sources)): return False
+    if page.query_tags:
+        bean_tags = set(map(beanops.canonical_tag, (bean.entities or []) + (bean.regions or []) + (bean.categories or [])))
+        if not bean_tags.intersection(map(beanops.canonical_tag, page.query_tags)): return False
+    return True
+
+class StandingQueries:
+    """Keeps the feeds of recently viewed stored pages materialized. 
+    Every batch of newly collected beans is scored against the embeddings of all registered pages with one matrix multiply 
+    and the matches that pass each page's filters are prepended to that page's bounded feed.
+    Each page remembers the latest collection time its feed already covers so that no bean is prepended twice."""
+    def __init__(self, max_pages: int, feed_length: int):
+        self.max_pages = max_pages
+        self.feed_length = feed_length
+        self._pages: OrderedDict[str, Page] = OrderedDict()
+        self._feeds: dict[str, deque] = {}
+        self._watermarks: dict[str, datetime] = {}
+        self._lock = threading.Lock()
+
+    def register(self, page: Page):
+        """Starts maintaining the page's feed. The feed is seeded from the regular vector search in the background"""
+        if page.query_embedding is None or page.query_urls: return
+        with self._lock:
+            if page.id in self._pages: 
+                self._pages.move_to_end(page.id)
+                return
+            self._pages[page.id] = page
+            while len(self._pages) > self.max_pages:
+                evicted, _ = self._pages.popitem(last=False)
+                self._feeds.pop(evicted, None)
+                self._watermarks.pop(evicted, None)
+        run_in_background(self._seed, page)
+
+    def drop(self, page_id: str):
+        """Forgets the page's feed, e.g. after its query changed. The next view registers it again"""
+        with self._lock:
+            self._pages.pop(page_id, None)
+            self._feeds.pop(page_id, None)
+            self._watermarks.pop(page_id, None)
+
+    def _seed(self, page: Page):
+        try:
+            # taken before the query so that beans landing in between get matched by the next refresh rather than missed
+            watermark = beanops._latest_collected()
+            beans = db_breaker.call(beanops.get_beans_for_stored_page.__wrapped__, page, None, None, MAX_WINDOW, LATEST, 0, self.feed_length)
+        except Exception as err:
+            # leave it unregistered so that the next view tries again
+            with self._lock: self._pages.pop(page.id, None)
+            log("standing_query_seed_error", page_id=page.id, error=str(err))
+            return
+        with self._lock:
+            if self._pages.get(page.id) is page: 
+                self._feeds[page.id] = deque(beans or [], maxlen=self.feed_length)
+                self._watermarks[page.id] = watermark
+
+    def refresh(self):
+        """Matches the beans collected since the last refresh against all registered pages"""
+        with self._lock:
+            pages = [page for page in self._pages.values() if page.id in self._feeds]
+            watermarks = {page.id: self._watermarks.get(page.id) for page in pages}
+        if not pages: return
+        
+        since = [watermark for watermark in watermarks.values() if watermark]
+        if not since: return
+        collected = beanops._latest_collected()
+        collected_filter = {"$gt": min(since), "$lte": collected}
+        for skip in range(0, MAX_STANDING_BATCHES*STANDING_BATCH_SIZE, STANDING_BATCH_SIZE):
+            beans = beanops.db.query_beans(
+                filter={K_COLLECTED: collected_filter, K_EMBEDDING: {"$exists": True}}, 
+                sort_by=None, skip=skip, limit=STANDING_BATCH_SIZE, 
+                project=beanops.BEAN_HEADER_FIELDS+[K_COLLECTED, K_EMBEDDING]
+            )
+            if beans: self._match(pages, watermarks, beans)
+            if not beans or len(beans) < STANDING_BATCH_SIZE: break
+        with self._lock:
+            for page in pages:
+                # a page that got seeded again in the meantime may already be past this refresh
+                if self._watermarks.get(page.id): self._watermarks[page.id] = max(self._watermarks[page.id], collected)
+
+    def _match(self, pages: list[Page], watermarks: dict, beans: list[Bean]):
+        beans = [bean for bean in beans if bean.embedding]
+        if not beans: return
+        scores = _normalized(np.asarray([bean.embedding for bean in beans], dtype=np.float32)) \
+            @ _normalized(np.stack([page.query_embedding for page in pages])).T
+        # the feeds only hold compact headers without the embeddings
+        headers = [beanops.BeanHeader.from_bean(bean) for bean in beans]
+        for header in headers: header.embedding = None
+        with self._lock:
+            for j, page in enumerate(pages):
+                feed = self._feeds.get(page.id)
+                if feed is None: continue
+                threshold = page.query_distance or config.filters.page.default_accuracy
+                watermark = watermarks.get(page.id)
+                for i in np.nonzero(scores[:, j] >= threshold)[0]:
+                    # the seed already holds everything collected up to the page's watermark
+                    if watermark and beans[i].collected and beans[i].collected <= watermark: continue
+                    if _matches_page_filters(page, headers[i]): feed.appendleft(headers[i])
+
+    def get(self, page_id: str, kind: str, last_ndays: int, sort_by, start: int, limit: int) -> list[Bean]|None:
+        """Serves a page of the materialized feed or None if the feed is not materialized or does not go deep enough"""
+        with self._lock:
+            feed = self._feeds.get(page_id)
+            if feed is None: return None
+            feed = list(feed)
+        since = ndays_ago(last_ndays) if last_ndays else None
+        beans, clusters = [], set()
+        for bean in feed:
+            if (kind and bean.kind != kind) or (since and bean.created < since): continue
+            # one bean per cluster, same as the vector search
+            if bean.cluster_id and bean.cluster_id in clusters: continue
+            clusters.add(bean.cluster_id)
+            beans.append(bean)
+        if sort_by == TRENDING: beans.sort(key=_engagement, reverse=True)
+        if start+limit > len(beans) and len(feed) >= self.feed_length: return None
+        return beans[start:start+limit]
+
+def _refresh_standing_queries():
+    try: standing_queries.refresh()
+    except Exception as err: log("standing_queries_refresh_error", error=str(err))
+
+standing_queries = StandingQueries(config.feeds.standing_pages, config.feeds.standing_feed_length)
+beanops.on_page_invalidated(standing_queries.drop)
+on_data_refresh(lambda: run_in_background(_refresh_standing_queries))
+
+def get_beans_for_stored_page(page: Page, kind: str, tags: str|list[str], last_ndays: int, sort_by, start: int, limit: int):
+    """Serves stored pages from their standing query feeds and falls back to beanops for tag-filtered views or pages that are not materialized yet.
+    NOTE: the feeds approximate the trending order by social media engagement"""
+    if tags: return beanops.get_beans_for_stored_page(page, kind, tags, last_ndays, sort_by, start, limit)
+    standing_queries.register(page)
+    beans = standing_queries.get(page.id, kind, last_ndays, sort_by, start, limit)
+    return beans if beans is not None else beanops.get_beans_for_stored_page(page, kind, tags, last_ndays, sort_by, start, limit)
@@ -0,0 +1,64 @@
+from datetime import date
+from html import escape
+from app.pybeansack.models import *
+from app.shared.consts import ONE_DAY
+from app.web.utils import *
+from app.web.caching import TTLCache
+from app.web import images, metrics
+
+# bean cards render the same for every visitor so their markup is built once and shared by all clients
+FRAGMENT_CACHE_SIZE = 5000
+
+BEAN_IMAGE_CLASSES = "w-32 rounded-borders"
+BEAN_TAG_CLASSES = "bean-tag text-caption ellipsis"
+
+_fragments = TTLCache(FRAGMENT_CACHE_SIZE, ONE_DAY)
+
+def bean_version(bean: Bean) -> tuple:
+    """Everything the card markup depends on besides the url. Keyed on the projected counters rather than `updated` which cached headers do not carry.
+    The day is included because the dates are humanized"""
+    chatter = (bean.chatter.comments, bean.chatter.likes, bean.chatter.shares) if bean.chatter else None
+    return (bean.comments, bean.likes, bean.shares), chatter, date.today()
+
+def _target(*args) -> str:
+    return "/"+"/".join(escape(arg.replace('/', '%2F'), quote=True) for arg in args)
+
+def _tag(text: str, target: str = None, tooltip: str = None, icon: str = None, max_width: str = "25ch") -> str:
+    style = f' style="max-width: {max_width}"' if max_width else ""
+    icon = f'<img class="bean-tag-icon" src="{escape(icon, quote=True)}" alt="">' if icon else ""
+    body = f'title="{escape(tooltip or text, quote=True)}" class="{BEAN_TAG_CLASSES}"{style}>{icon}{escape(text)}'
+    return f'<a href="{target}" {body}</a>' if target else f'<span {body}</span>'
+
+def bean_tags_html(bean: Bean) -> str:
+    """Same tags as `renderer.render_bean_tags` with links in place of click handlers"""
+    tags = [
+        _tag(naturalday(bean.created)),
+        _tag(site_name(bean), _target("sources", bean.source), icon=images.proxy_url(favicon(bean), images.FAVICON_WIDTH))
+    ]
+    if bean.author: tags.append(_tag(f"✍️ {bean.author}", max_width="15ch"))
+    if bean.categories: tags.append(_tag(f"🏷️ {bean.categories[0]}", _target("categories", bean.categories[0])))
+    if bean.regions: tags.append(_tag(f"📍 {bean.regions[0]}", _target("regions", bean.regions[0])))
+    if bean.chatter:
+        if bean.chatter.comments: tags.append(_tag(f"💬 {naturalnum(bean.chatter.comments)}", tooltip=f"{bean.chatter.comments} comments across various social media sources"))
+        if bean.chatter.likes: tags.append(_tag(f"👍 {naturalnum(bean.chatter.likes)}", tooltip=f"{bean.chatter.likes} likes across various social media sources"))
+        if bean.chatter.shares and bean.chatter.shares > 1: tags.append(_tag(f"🔗 {bean.chatter.shares}", tooltip=f"{bean.chatter.shares} shares across various social media sources"))
+    return f'<div class="row items-center gap-2 q-my-xs">{"".join(tags)}</div>'
+
+def _build_bean_header(bean: Bean) -> str:
+    image = f'<img src="{escape(images.proxy_url(bean.image_url), quote=True)}" class="{BEAN_IMAGE_CLASSES}" loading="lazy" alt="">' if bean.image_url else ""
+    return "".join([
+        '<div class="row no-wrap items-stretch w-full bean-header">',
+        image,
+        f'<div class="w-full"><div class="bean-title">{escape(bean.title or "")}</div>{bean_tags_html(bean)}</div>',
+        '</div>'
+    ])
+
+def bean_header_html(bean: Bean) -> str:
+    """Card header markup for the bean from the shared fragment cache. Rebuilt when any of the fields in `bean_version` change"""
+    key = (bean.url, bean_version(bean))
+    html = _fragments.get(key)
+    if html is not None:
+        metrics.increment("fragment_hit")
+        return html
+    metrics.increment("fragment_miss")
+    return _fragments.put(key, _build_bean_header(bean))
@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import hmac
+import io
+import ipaddress
+import os
+import socket
+import threading
+from collections import OrderedDict
+from urllib.parse import urlencode
+import httpx
+from PIL import Image
+from app.shared.env import *
+from app.web import lanes, metrics
+
+# bean images and favicons are fetched from their origins once, shrunk to the size they are displayed at and served from a bounded disk cache
+THUMBNAIL_WIDTH = 256 # bean card images are displayed at w-32, this covers 2x screens
+FAVICON_WIDTH = 32
+CONTENT_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+# without a secret anyone could sign urls, so nothing is signed or served and images load straight from their origins
+_secret = lambda: os.getenv("APP_STORAGE_SECRET")
+_sign = lambda url, width: hmac.new(_secret().encode(), f"{url}|{width}".encode(), hashlib.sha256).hexdigest()[:16]
+
+def proxy_url(url: str, width: int = THUMBNAIL_WIDTH) -> str:
+    """Signed /img url for the origin image so that the proxy cannot be used to fetch arbitrary urls"""
+    if not url or not url.startswith("http") or not _secret(): return url
+    return "/img?"+urlencode({"u": url, "w": width, "s": _sign(url, width)})
+
+def verify(url: str, width: int, signature: str) -> bool:
+    return bool(_secret()) and hmac.compare_digest(_sign(url, width), signature or "")
+
+class ThumbnailCache:
+    """Disk cache of resized images with LRU eviction once the total size goes past `max_bytes`. 
+    The index lives in memory and is rebuilt from the directory on startup."""
+    def __init__(self, dir: str, max_bytes: int):
+        self.dir = dir
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # file name -> size
+        self._total = 0
+        self._lock = threading.Lock()
+        os.makedirs(dir, exist_ok=True)
+        files = sorted(os.scandir(dir), key=lambda entry: entry.stat().st_atime)
+        for entry in files:
+            self._entries[entry.name] = entry.stat().st_size
+            self._total += entry.stat().st_size
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    def get(self, name: str) -> str|None:
+        with self._lock:
+            if name not in self._entries: return None
+            self._entries.move_to_end(name)
+        return self.path(name)
+
+    def put(self, name: str, data: bytes) -> str:
+        temp = self.path(f"{name}.{threading.get_ident()}.tmp")
+        with open(temp, "wb") as file: file.write(data)
+        os.replace(temp, self.path(name))
+        with self._lock:
+            self._total += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                evicted, size = self._entries.popitem(last=False)
+                self._total -= size
+                try: os.remove(self.path(evicted))
+                except FileNotFoundError: pass
+                metrics.increment("thumbnail_evicted")
+        return self.path(name)
+
+thumbnails = ThumbnailCache(config.images.cache_dir, config.images.cache_max_bytes)
+_fetches: dict[str, asyncio.Task] = {}
+
+def _resize(data: bytes, width: int, format: str) -> bytes:
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail((width, width*4))
+        if format == "jpeg" and image.mode not in ("RGB", "L"): image = image.convert("RGB")
+        output = io.BytesIO()
+        image.save(output, format=format.upper(), quality=config.images.quality)
+        return output.getvalue()
+
+def _is_public(address) -> bool:
+    if getattr(address, "ipv4_mapped", None): address = address.ipv4_mapped
+    return address.is_global
+
+async def _check_origin(url: httpx.URL):
+    """Rejects origins that are not plain http(s) on public addresses so that signed urls cannot reach 
+    loopback, private networks or the cloud metadata endpoint (169.254.169.254)"""
+    if url.scheme not in ("http", "https") or not url.host: raise ValueError("origin image url is not http(s)")
+    try: resolved = await asyncio.get_running_loop().getaddrinfo(url.host, url.port or (443 if url.scheme == "https" else 80), type=socket.SOCK_STREAM)
+    except socket.gaierror: raise ValueError("origin image host does not resolve")
+    if not resolved or not all(_is_public(ipaddress.ip_address(info[4][0])) for info in resolved): raise ValueError("origin image host is not public")
+
+async def _download(client: httpx.AsyncClient, url: str) -> bytes:
+    """Streams the origin image and gives up as soon as it is known to be larger than `max_origin_bytes`.
+    Redirects are only followed as long as they stay on the origin's host. Every hop is checked to be on a public address"""
+    url = httpx.URL(url)
+    host, limit = url.host, config.images.max_origin_bytes
+    for _ in range(config.images.max_redirects+1):
+        await _check_origin(url)
+        async with client.stream("GET", url, headers={"User-Agent": config.app.name}) as response:
+            if response.is_redirect:
+                url = response.next_request.url
+                if url.host != host: raise ValueError("origin image redirects to another host")
+                continue
+            response.raise_for_status()
+            if int(response.headers.get("content-length") or 0) > limit: raise ValueError("origin image too large")
+            data = bytearray()
+            async for chunk in response.aiter_bytes():
+                data += chunk
+                if len(data) > limit: raise ValueError("origin image too large")
+            return bytes(data)
+    raise ValueError("origin image redirects too many times")
+
+async def _fetch(url: str, width: int, format: str, name: str) -> str:
+    async with httpx.AsyncClient(timeout=config.images.fetch_timeout, follow_redirects=False) as client:
+        data = await _download(client, url)
+    data = await lanes.expensive.run(_resize, data, width, format)
+    metrics.increment("thumbnail_fetched")
+    return thumbnails.put(name, data)
+
+async def get_thumbnail(url: str, width: int, format: str) -> str:
+    """Returns the path of the cached thumbnail, fetching and resizing the origin image on a miss. Concurrent misses for the same thumbnail share one fetch"""
+    name = hashlib.sha1(f"{url}|{width}".encode()).hexdigest()+"."+format
+    path = thumbnails.get(name)
+    if path: 
+        metrics.increment("thumbnail_hit")
+        return path
+    task = _fetches.get(name)
+    if not task:
+        task = _fetches[name] = asyncio.create_task(_fetch(url, width, format, name))
+        task.add_done_callback(lambda _: _fetches.pop(name, None))
+    return await asyncio.shield(task)
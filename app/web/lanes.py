@@ -0,0 +1,65 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app.shared.env import *
+from app.web import metrics
+
+class LaneSaturated(Exception):
+    """Raised when a lane already has more work in flight than it admits"""
+
+class Lane:
+    """Dedicated executor for one class of blocking data access so that slow calls in one lane cannot starve the other.
+    Queue depth and queue wait times are reported to metrics. 
+    With `max_queue` set, calls beyond `max_workers + max_queue` in flight are rejected right away with `LaneSaturated` instead of queueing up."""
+    def __init__(self, name: str, max_workers: int, max_queue: int = None):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"lane-{name}")
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self) -> int:
+        return max(self._in_flight - self.max_workers, 0)
+
+    def _admit(self):
+        with self._lock:
+            if self.max_queue is not None and self._in_flight >= self.max_workers + self.max_queue:
+                metrics.increment(f"lane.{self.name}.rejected")
+                raise LaneSaturated(self.name)
+            self._in_flight += 1
+            metrics.set_gauge(f"lane.{self.name}.queue_depth", self.queue_depth)
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+            metrics.set_gauge(f"lane.{self.name}.queue_depth", self.queue_depth)
+
+    async def run(self, func, *args, **kwargs):
+        """Runs the blocking `func` on this lane's threads. Context variables of the caller are carried over"""
+        self._admit()
+        queued_at = time.perf_counter()
+        context = contextvars.copy_context()
+
+        def work():
+            started_at = time.perf_counter()
+            metrics.observe(f"lane.{self.name}.wait", started_at - queued_at)
+            try: return context.run(func, *args, **kwargs)
+            finally: metrics.observe(f"lane.{self.name}.run", time.perf_counter() - started_at)
+
+        try: future = self._executor.submit(work)
+        except:
+            self._release()
+            raise
+        # released when the work is done rather than when the caller stops waiting: a cancelled caller leaves the thread busy until then.
+        # a call cancelled before it started is done right away
+        future.add_done_callback(lambda _: self._release())
+        return await asyncio.wrap_future(future)
+
+# cheap: point lookups and small cached reads that the UI chrome depends on (navigation, page names, filter tags, counts, bean bodies)
+cheap = Lane("cheap", config.lanes.cheap_workers)
+# expensive: feeds, vector and text searches, bulk cluster loads. Fails fast when saturated so that it never builds an unbounded backlog
+expensive = Lane("expensive", config.lanes.expensive_workers, config.lanes.expensive_max_queue)
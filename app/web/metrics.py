@@ -0,0 +1,30 @@
+import threading
+from collections import defaultdict
+
+_counters = defaultdict(int)
+_gauges = {}
+_timings = defaultdict(lambda: [0, 0.0, 0.0]) # count, total, max
+_lock = threading.Lock()
+
+def increment(name: str, value: int = 1):
+    with _lock:
+        _counters[name] += value
+
+def set_gauge(name: str, value: float):
+    with _lock:
+        _gauges[name] = value
+
+def observe(name: str, seconds: float):
+    with _lock:
+        timing = _timings[name]
+        timing[0] += 1
+        timing[1] += seconds
+        timing[2] = max(timing[2], seconds)
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "timings": {name: {"count": count, "avg": total/count, "max": longest} for name, (count, total, longest) in _timings.items()}
+        }
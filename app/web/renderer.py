@@ -4,18 +4,19 @@ import random
 import threading
 from typing import Awaitable, Callable
 from urllib.parse import urlencode, urljoin
-from nicegui import ui, run, app
+from nicegui import ui, run, app, background_tasks
 from app.pybeansack.models import *
 from app.shared.utils import *
 from app.shared.consts import *
 from app.shared.env import *
 from app.web.context import *
-from app.web import beanops
-from app.web.custom_ui import SwitchButton
+from app.web import accounting, assets, beanops, fragments, images, lanes, metrics
+from app.web.custom_ui import SwitchButton, VirtualList
 from icecream import ic
 
 CSS_FILE = "./app/web/styles.css"
 SEO_HTML = "./app/web/seo.html"
+STYLES = read_file(CSS_FILE) # read once instead of on every page render
 
 MATERIAL_ICONS = """<link href="https://fonts.googleapis.com/icon?family=Material+Icons" rel="stylesheet">"""
 GOOGLE_ANALYTICS_SCRIPT = """
@@ -46,8 +47,8 @@ BEAN_META_TAGS = """
 <meta name="twitter:description" content="{description}">
 <meta name="twitter:image" content="{image_url}">
 <link rel="canonical" href="{url}">
-<link rel="icon" type="image/x-icon" href="/images/favicon.ico">
-<link rel="apple-touch-icon" type="image/png" href="/images/espresso.png">
+<link rel="icon" type="image/x-icon" href="{favicon}">
+<link rel="apple-touch-icon" type="image/png" href="{touch_icon}">
 <meta name="DC.title" content="{title}">
 <meta name="DC.description" content="{description}">
 <meta name="DC.subject" content="{tags}">
@@ -66,6 +67,7 @@ SEARCH_BAR_PROPS = "item-aligned standout clearable clear-icon=close maxlength=1
 LOGIN_MENU_PROPS = "transition-show=jump-down transition-hide=jump-up"
 FILTER_TAGS_BAR_PROPS = "dense shrink no-caps mobile-arrows active-bg-color=primary indicator-color=transparent"
 BEANS_GRID_CLASSES = "w-full m-0 p-0 grid-cols-1 bg-transparent"
+BEANS_LIST_CLASSES = "w-full h-[75vh] m-0 p-0 bg-transparent"
 BEAN_TAG_CLASSES = "ml-0 mr-2 my-0 p-0 text-caption"
 FILTER_TAG_CLASSES = "rounded-full bg-dark q-mr-sm"
 
@@ -74,11 +76,12 @@ REDDIT_ICON = "img:https://www.reddit.com/favicon.ico"
 LINKEDIN_ICON = "img:https://www.linkedin.com/favicon.ico"
 SLACK_ICON = "img:https://slack.com/favicon.ico"
 TWITTER_ICON = "img:https://www.x.com/favicon.ico"
-WHATSAPP_ICON = "img:/images/whatsapp.png"
-ESPRESSO_ICON = "img:/images/favicon.ico"
+WHATSAPP_ICON = "img:"+assets.manifest.url("/images/whatsapp.png")
+ESPRESSO_ICON = "img:"+assets.manifest.url("/images/favicon.ico")
 
 MAX_WORD_LENGTH = 30
 MAX_SUMMARY_LENGTH = 120
+MAX_SOURCE_OPTIONS = 30
 
 LOGIN_OPTIONS = [
     {
@@ -161,7 +164,7 @@ def render_frame(context: Context):
 
 def render_header(context: Context):
     ui.colors(primary=PRIMARY_COLOR, secondary=SECONDARY_COLOR)  
-    ui.add_css(CSS_FILE)    
+    ui.add_css(STYLES)    
   
     with ui.dialog() as search_dialog, ui.card(align_items="stretch").classes("w-full"):
         render_search_bar(context).classes("fit")      
@@ -171,7 +174,7 @@ def render_header(context: Context):
     with ui.header(wrap=False).props("reveal").classes("justify-between items-stretch rounded-borders p-1 q-ma-xs") as header:     
         with ui.button(on_click=internal_nav).props("unelevated").classes("q-px-xs"):
             with ui.avatar(square=True, size="md").classes("rounded-borders"):
-                ui.image("images/espresso.png")
+                ui.image(assets.manifest.url("/images/espresso.png"))
             ui.label("Beans").classes("q-ml-sm")
             
         nav_button = ui.button(icon="local_cafe_outlined", on_click=nav_panel.toggle).props("unelevated").classes("lt-sm")
@@ -228,11 +231,21 @@ def render_user_menu(context: Context):
 
 # render baristas for navigation
 async def load_navigation_panel(context: Context, navigation_panel): 
-    navigation_items = await run.io_bound(_create_navigation_baristas, context)
+    navigation_items = _create_navigation_baristas(context)
+    tab_panels, loaded_tabs = {}, set()
+
+    async def load_tab(label: str):
+        # the items of a tab are loaded and rendered only when the tab is opened for the first time
+        item = next((item for item in navigation_items if item['label'] == label), None)
+        if not item or label in loaded_tabs: return
+        loaded_tabs.add(label)
+        pages = await lanes.cheap.run(item['load'])
+        render_page_names(context, pages, tab_panels[label])
+
     with navigation_panel: 
         with ui.row(wrap=False, align_items="start").classes("gap-0 "+ STRETCH_FIT):
 
-            with ui.tabs().props("vertical outside-arrows mobile-arrows shrink active-bg-color=primary indicator-color=transparent").classes("q-mt-md") as tabs:
+            with ui.tabs(on_change=lambda e: load_tab(e.value)).props("vertical outside-arrows mobile-arrows shrink active-bg-color=primary indicator-color=transparent").classes("q-mt-md") as tabs:
                 ui.tab("search", label="", icon="search")
                 if navigation_items: [ui.tab(item['label'], label="", icon=item['icon']).tooltip(item['label']) for item in navigation_items]
                 ui.element("q-route-tab").props("href=/ icon=home_outlined")
@@ -242,12 +255,13 @@ async def load_navigation_panel(context: Context, navigation_panel):
                     with ui.tab_panel("search").classes(STRETCH_FIT):
                         render_page_search_panel(context)
 
-                    if navigation_items:
-                        for item in navigation_items:
-                            with ui.tab_panel(item['label']).classes(STRETCH_FIT):
-                                render_page_names(context, item['items'], ui.list().classes(STRETCH_FIT))
-                        tabs.set_value(navigation_items[0]['label'])
+                    for item in navigation_items:
+                        with ui.tab_panel(item['label']).classes(STRETCH_FIT):
+                            tab_panels[item['label']] = ui.list().classes(STRETCH_FIT)
         
+    if navigation_items:
+        tabs.set_value(navigation_items[0]['label'])
+        await load_tab(navigation_items[0]['label'])
     return navigation_panel  
 
 def render_search_controls(context: Context):
@@ -273,8 +287,13 @@ def render_search_controls(context: Context):
                         last_ndays = ui.slider(min=MIN_WINDOW, max=MAX_WINDOW, step=1, value=context.last_ndays or config.filters.bean.default_window).props("reverse")
                         last_ndays_container.bind_text_from(last_ndays, "value", 
                             lambda v: f"Since {(datetime.now() - timedelta(days=v)).strftime('%b %d')}")
-            sources = ui.select(options=beanops.get_all_sources(), value=context.sources, label="Feeds", with_input=True, multiple=True, clearable=True) \
+            sources = ui.select(options=context.sources or [], value=context.sources, label="Feeds", with_input=True, multiple=True, clearable=True) \
                 .props("standout max-values=20 dropdown-icon=rss_feed dense clear-icon=close").classes("text-caption")
+            # options are looked up in the source registry as the user types instead of shipping the whole catalog
+            sources.on("input-value", lambda e: sources.set_options(
+                sorted(set(beanops.search_sources(e.args, MAX_SOURCE_OPTIONS)) | set(sources.value or [])), 
+                value=sources.value
+            ))
     return panel
 
 def render_search_bar(context: Context):
@@ -296,7 +315,7 @@ def render_page_search_panel(context: Context):
         search_results_panel.clear()
         if not query: return 
         context.log("search_page", query=query)
-        pages = await run.io_bound(beanops.search_pages, query)
+        pages = await run_expensive(beanops.search_pages, query)
         if pages: render_page_names(context, pages, search_results_panel)
         else:
             with search_results_panel:
@@ -332,7 +351,7 @@ def render_page_banner(context: Context):
     return view
 
 async def load_and_render_filter_tags(context: Context, load_items: Callable, on_selection_changed: Callable):
-    items = await run.io_bound(load_items)
+    items = await lanes.cheap.run(load_items)
     return render_filter_tags(context, items, on_selection_changed)
 
 def render_filter_tags(context: Context, items: list|dict, on_selection_changed: Callable):
@@ -357,10 +376,31 @@ def render_page_names(context: Context, pages: list[Page], container: ui.element
     return container
 
 async def load_and_render_page_names(context: Context, load_pages: Callable, container: ui.element = None):           
-    pages = await run.io_bound(load_pages, context)
+    pages = await lanes.cheap.run(load_pages, context)
     if container: container.clear()
     render_page_names(context, pages, container)
 
+def _load_bean_details(beans: list[Bean], context: Context):
+    beanops.load_clusters(beans, config.filters.bean.max_related)
+    beanops.prefetch_bean_bodies(beans)
+    # the bookmark set comes along so that bookmark indicators are set lookups
+    if context and context.is_user_registered: beanops.get_bookmarks(context.user)
+
+async def _prefetch_bean_details(beans: list[Bean], context: Context):
+    try: await lanes.expensive.run(_load_bean_details, beans, context)
+    except lanes.LaneSaturated: pass # it is only a prefetch, the details are still loaded on demand
+
+def prefetch_bean_details(beans: list[Bean], context: Context = None):
+    """Loads the clusters and the bodies of all the beans about to be rendered in bulk and in the background so that expanding a bean or opening related stories is a cache read"""
+    if beans: background_tasks.create(_prefetch_bean_details(beans, context), name="prefetch_bean_details")
+
+async def run_expensive(func, *args, **kwargs):
+    """Runs a heavy read on the expensive lane. When the lane is saturated it tells the user and returns None so that callers render their empty state"""
+    try: return await lanes.expensive.run(func, *args, **kwargs)
+    except lanes.LaneSaturated:
+        ui.notify(TOO_BUSY, type="warning")
+        return None
+
 def render_grid(max_columns: int = 3): 
     classes = BEANS_GRID_CLASSES
     if max_columns == 2: classes += " lg:grid-cols-2"
@@ -369,50 +409,86 @@ def render_grid(max_columns: int = 3):
 
 async def load_and_render_beans(context: Context, load_beans: Callable):
     with render_grid() as container:
-        beans = await run.io_bound(load_beans)
+        beans = await run_expensive(load_beans)
+        prefetch_bean_details(beans, context)
         if beans: [render_bean_with_related(context, bean).classes(STRETCH_FIT) for bean in beans] 
         else: ui.label(NOTHING_FOUND).classes("w-full text-center") 
     return container
 
+class PrefetchBuffer:
+    """Holds the next page of a feed while it is being fetched in the background"""
+    task: asyncio.Task = None
+
+    def fill(self, coro):
+        self.discard()
+        self.task = background_tasks.create(coro, name="prefetch")
+
+    def take(self) -> asyncio.Task|None:
+        task, self.task = self.task, None
+        metrics.increment("prefetch_hit" if task else "prefetch_miss")
+        return task
+
+    def discard(self):
+        task, self.task = self.task, None
+        if not task: return
+        task.cancel()
+        metrics.increment("prefetch_waste")
+
 async def load_and_render_beans_as_extendable_list(context: Context, load_beans: Callable):
     current_start = 0   
+    page_size = config.filters.page.max_beans
+    prefetched = PrefetchBuffer()
+
     async def next_page():
         nonlocal current_start
         with disable_button(more_btn):
-            beans = await run.io_bound(load_beans, current_start, config.filters.page.max_beans+1) 
-            current_start += config.filters.page.max_beans # moving the cursor no matter what
-            if not beans or len(beans) <= config.filters.page.max_beans: more_btn.delete()            
-            with beans_panel:
-                if beans: [render_bean_with_related(context, bean).classes(STRETCH_FIT) for bean in beans[:config.filters.page.max_beans]]
-                else: ui.label(NOTHING_FOUND).classes("w-full text-center") 
+            task = prefetched.take()
+            try: beans = (await task) if task else None
+            except lanes.LaneSaturated: task = None
+            if not task: beans = await run_expensive(load_beans, current_start, page_size+1)
+            # logged when the page is shown rather than when it is fetched so that unused prefetches do not count
+            context.log("retrieve", start=current_start, limit=page_size)
+            current_start += page_size # moving the cursor no matter what
+            prefetch_bean_details(beans[:page_size] if beans else None, context)
+            if not beans or len(beans) <= page_size: more_btn.delete()
+            elif not beans_panel.is_deleted: prefetched.fill(lanes.expensive.run(load_beans, current_start, page_size+1))
+            if beans: 
+                beans_panel.extend(beans[:page_size])
+                accounting.hold(beans[:page_size], beans_panel)
+            elif not beans_panel.items: 
+                beans_panel.delete()
+                with view: ui.label(NOTHING_FOUND).classes("w-full text-center").move(target_index=0)
 
     with ui.column() as view:
-        beans_panel = render_grid()
+        # only the cards around the viewport exist as elements no matter how many times "More Stories" is clicked
+        beans_panel = VirtualList(lambda bean: render_bean_with_related(context, bean).classes(STRETCH_FIT), key=lambda bean: bean.url).classes(BEANS_LIST_CLASSES)
         more_btn = ui.button("More Stories", on_click=next_page).props("rounded no-caps icon-right=chevron_right")
+    # the prefetched page goes with the list, whether it is refreshed with other filters or the client goes away
+    beans_panel.on_delete(prefetched.discard)
+    # over budget the older half of the list is let go of
+    accounting.on_over_budget(lambda: beans_panel.drop_oldest(len(beans_panel.items)//2), beans_panel)
 
     await next_page()
     return view
 
-async def load_and_render_beans_as_paginated_list(context: Context, load_beans: Callable, count_items: Callable):   
+async def load_and_render_beans_as_paginated_list(context: Context, load_page: Callable):   
+    """`load_page(start, limit)` returns a page of beans along with the total number of items"""
     async def next_page(page):
-        beans = await run.io_bound(load_beans, (page-1)*config.filters.page.max_beans, config.filters.page.max_beans)   
+        beans, count = (await run_expensive(load_page, (page-1)*config.filters.page.max_beans, config.filters.page.max_beans)) or (None, 0)
+        prefetch_bean_details(beans, context)
         beans_panel.clear()
         with beans_panel:
             if beans: [render_bean_with_related(context, bean).classes(STRETCH_FIT) for bean in beans] 
             else: ui.label(NOTHING_FOUND).classes("w-full text-center") 
-        return beans
-    
-    async def page_bar():
-        count = await run.io_bound(count_items)
-        with bar_panel:
-            render_pagination_bar(count, lambda page: next_page(page))
         return count
 
     with ui.column(align_items="stretch") as panel:
         beans_panel = render_grid()
         bar_panel = ui.element()
 
-    await asyncio.gather(*[next_page(1), page_bar()])
+    count = await next_page(1)
+    with bar_panel:
+        render_pagination_bar(count, lambda page: next_page(page))
     return panel
 
 def render_bean_with_related(context: Context, bean: Bean):
@@ -425,8 +501,10 @@ def render_bean_with_related(context: Context, bean: Bean):
     async def on_read():
         nonlocal related_beans
         if related_beans: return
-        related_beans = await run.io_bound(beanops.get_beans_in_cluster, id=bean.id, kind=None, tags=None, sources=None, last_ndays=None, start=0, limit=config.filters.bean.max_related)
+        related_beans = beanops.get_cached_related_beans(bean, config.filters.bean.max_related)
+        if related_beans is None: related_beans = await lanes.cheap.run(beanops.get_beans_in_cluster, id=bean.id, kind=None, tags=None, sources=None, last_ndays=None, start=0, limit=config.filters.bean.max_related)
         if not related_beans: return
+        accounting.hold(related_beans, carousel)
         with carousel:
             for item in related_beans:
                 render_bean_as_slide(item, True, None) # NOTE: keep them expanded by default and no need for callback
@@ -451,8 +529,9 @@ def render_expandable_bean(context: Context, bean: Bean, expanded: bool = False,
         context.log("read", url=bean.url)
 
         if body_loaded: return
+        body = beanops.get_cached_bean_body(bean) or (await lanes.cheap.run(beanops.load_bean_body, bean))
         with expansion: 
-            render_bean_summary(context, beanops.load_bean_body(bean))
+            render_bean_summary(context, body)
             body_loaded = True
 
     with ui.expansion(value=expanded, on_value_change=load_body) \
@@ -467,7 +546,7 @@ def render_expandable_bean(context: Context, bean: Bean, expanded: bool = False,
     return expansion
 
 async def load_and_render_whole_bean(context, url):
-    bean = await run.io_bound(db.get_bean, url=url, project=beanops.WHOLE_BEAN_FIELDS)
+    bean = await lanes.cheap.run(db.get_bean, url=url, project=beanops.WHOLE_BEAN_FIELDS)
     return render_whole_bean(context, bean), bean
 
 def render_whole_bean(context: Context, bean: Bean):
@@ -511,18 +590,16 @@ add_bean_meta_tags = lambda bean: ui.add_head_html(BEAN_META_TAGS.format(
     url=create_target("articles", bean.id),
     tags=", ".join(bean.tags or []),
     creator=bean.author,
-    publisher="Cafecito Publications"
+    publisher="Cafecito Publications",
+    favicon=assets.manifest.url("/images/favicon.ico"),
+    touch_icon=assets.manifest.url("/images/espresso.png")
 ))
 
 render_bean_snapshot = render_expandable_bean
 
 def render_bean_header(context: Context, bean: Bean):
-    with ui.row(wrap=False, align_items="stretch").classes("w-full bean-header") as view:            
-        if bean.image_url: ui.image(bean.image_url).classes(IMAGE_DIMENSIONS)
-        with ui.element().classes("w-full"):
-            ui.label(bean.title).classes("bean-title")  
-            render_bean_tags(context, bean).classes("gap-2 q-my-xs")
-    return view
+    # one html element from the shared fragment cache instead of an element subtree per chip
+    return ui.html(fragments.bean_header_html(bean)).classes("w-full")
 
 render_tag_as_link = lambda tag, link: ui.link(tag, link, new_tab=link.startswith("http")) \
     .classes("q-mr-md max-w-[30ch] ellipsis") \
@@ -541,7 +618,7 @@ def render_tag_as_chip(title, target=None, max_width: str = "25ch"):
 def render_bean_source_tags(context: Context, bean: Bean):
     with ui.row(align_items="center", wrap=False)as view:
         render_tag_as_chip(naturalday(bean.created))
-        render_tag_as_chip(site_name(bean), create_target("sources", bean.source)).props("icon=img:"+favicon(bean))
+        render_tag_as_chip(site_name(bean), create_target("sources", bean.source)).props("icon=img:"+images.proxy_url(favicon(bean), images.FAVICON_WIDTH))
         if bean.author: render_tag_as_chip(f"✍️ {bean.author}").classes(remove="max-w-[25ch]", add="max-w-[12ch]")
     return view
 
@@ -574,7 +651,7 @@ def render_bean_tags(context: Context, bean: Bean, truncate: bool = True):
     max_width = "25ch" if truncate else None
     with ui.row(align_items="center") as view:
         render_tag_as_chip(naturalday(bean.created), max_width=max_width)
-        render_tag_as_chip(site_name(bean), create_target("sources", bean.source), max_width=max_width).props("icon=img:"+favicon(bean))
+        render_tag_as_chip(site_name(bean), create_target("sources", bean.source), max_width=max_width).props("icon=img:"+images.proxy_url(favicon(bean), images.FAVICON_WIDTH))
         
         if bean.author: render_tag_as_chip(f"✍️ {bean.author}", max_width="15ch" if truncate else None)    
         if bean.categories: render_tag_as_chip(f"🏷️ {bean.categories[0]}", create_target('categories', bean.categories[0]), max_width=max_width)         
@@ -686,7 +763,7 @@ def render_report_a_bug():
 
 async def render_pagination_bar(count_items: Callable, on_change: Callable):
     async def render():
-        items_count = await run.io_bound(count_items)
+        items_count = await lanes.cheap.run(count_items)
         page_count = -(-items_count//config.filters.page.max_beans)
         view.clear()
         if items_count > config.filters.page.max_beans:
@@ -700,7 +777,7 @@ async def render_pagination_bar(count_items: Callable, on_change: Callable):
     return view
 
 def render_pagination_bar(items_count: int, on_change: Callable):
-    if items_count <= config.filters.page.max_beans: return # no need render anything
+    if not items_count or items_count <= config.filters.page.max_beans: return # no need render anything
     page_count = -(-items_count//config.filters.page.max_beans)
     return ui.pagination(value=1, min=1, max=page_count, direction_links=True, on_change=lambda e: on_change(e.sender.value)).props("max-pages=10 ellipses")
 
@@ -743,11 +820,11 @@ def render_card_container(label: str, on_click: Callable = None, header_classes:
 def toggle_bookmark(context: Context, bean: Bean):
     if not context.is_user_registered: return False
 
-    if beanops.db.is_bookmarked(context.user, bean.url):
-        beanops.db.unbookmark(context.user, bean.url)   
+    if beanops.is_bookmarked(context, bean.url):
+        beanops.unbookmark(context, bean.url)   
         context.log("unbookmarked", url=bean.url)         
     else:
-        beanops.db.bookmark(context.user, bean.url)
+        beanops.bookmark(context, bean.url)
         context.log("bookmarked", url=bean.url)
 
     return True
@@ -762,6 +839,7 @@ def toggle_publish(context: Context):
     else:
         beanops.db.publish(barista.id)
         context.log("published", page_id=barista.id)
+    beanops.invalidate_page(barista.id)
 
     return True
 
@@ -775,6 +853,7 @@ def toggle_follow(context: Context):
     else:
         beanops.db.unfollow_barista(context.user.email, barista.id)
         context.log("unfollowed", page_id=barista.id)
+    beanops.invalidate_user(context.user.email)
 
     return True
 
@@ -799,32 +878,33 @@ def create_debounce(func, wait):
     return debounced
 
 def _create_navigation_baristas(context: Context):
+    """Returns the navigation tabs along with the functions that load their items. Nothing gets loaded here."""
     items = [
         {
             "icon": "web_stories", # local_cafe_outlined # newsstand # web_stories # bookmarks # browse
             "label": "Following",
-            "items": db.get_following_pages(context.user, beanops.PAGE_DEFAULT_FIELDS) if context.is_user_registered else None
+            "load": (lambda: beanops.get_following_pages(context.user)) if (context.is_user_registered and context.user.following) else None
         },
         {
             "icon": "label_outlined",
             "label": "Channels",
-            "items": beanops.get_pages(config.navigation.default_pages)
+            "load": lambda: beanops.get_pages(config.navigation.default_pages)
         },
         # {
         #     "icon": "rss_feed",
         #     "label": "Outlets",
-        #     "items": beanops.get_baristas(DEFAULT_OUTLET_BARISTAS)
+        #     "load": lambda: beanops.get_baristas(DEFAULT_OUTLET_BARISTAS)
         # },
         # {
         #     "icon": "tag",
         #     "label": "Tags",
-        #     "items": beanops.get_baristas(DEFAULT_TAG_BARISTAS)
+        #     "load": lambda: beanops.get_baristas(DEFAULT_TAG_BARISTAS)
         # },
         # {
         #     "icon": "scatter_plot",
         #     "label": "Explore",
-        #     "items": beanops.get_barista_recommendations(context)
+        #     "load": lambda: beanops.get_barista_recommendations(context)
         # }
         
     ]
-    return [item for item in items if item["items"]]
\ No newline at end of file
+    return [item for item in items if item["load"]]
\ No newline at end of file
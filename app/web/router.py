@@ -5,8 +5,12 @@ from app.pybeansack.models import *
 from app.shared.env import *
 from app.shared.consts import *
 from app.shared.utils import *
-from app.web import beanops, vanilla, renderer
+from app.web import accounting, assets, beanops, events, feeds, images, metrics, snapshots, vanilla, renderer
+from app.shared.admin import verify_admin_key
+from app.shared import profiling
+from app.shared.tracing import traced, configure_tracing, instrument_app
 from app.web.context import *
+from app.web.caching import TTLCache, db_breaker
 
 import jwt
 from datetime import datetime, timedelta
@@ -15,7 +19,7 @@ from starlette.middleware.sessions import SessionMiddleware
 from starlette.requests import Request
 from starlette.responses import RedirectResponse, FileResponse
 from authlib.integrations.starlette_client import OAuth
-from nicegui import ui, app
+from nicegui import ui, app, background_tasks
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_ipaddr
@@ -76,10 +80,15 @@ def create_jwt_token(email: str):
     
     return jwt.encode(data, os.getenv('APP_STORAGE_SECRET'), algorithm="HS256")
 
+# decoded tokens are memoized for a short while. the expiry is still checked on every hit
+_decoded_tokens = TTLCache(max_size=beanops.USER_CACHE_SIZE, ttl=config.cache.user_ttl)
+
 def decode_jwt_token(token: str):
+    data = _decoded_tokens.get(token)
+    if data and data['exp'] > datetime.now().timestamp(): return data
     try:
         data = jwt.decode(token, os.getenv('APP_STORAGE_SECRET'), algorithms=["HS256"], verify=True)
-        return data if (data and "email" in data) else None
+        return _decoded_tokens.put(token, data) if (data and "email" in data) else None
     except Exception as err:
         log("jwt_token_decode_error", user_id=app.storage.browser.get("id"), error=str(err))
         return None
@@ -134,11 +143,24 @@ def initialize_server():
         user_agent=config.app.name
     )    
     
+    snapshots.purge_snapshots()
+    beanops.run_in_background(beanops.source_registry.refresh)
+    beanops.run_in_background(beanops.tag_catalog.refresh)
+    background_tasks.create(beanops.watch_for_new_beans(config.cache.refresh_check_interval), name="watch_for_new_beans")
+    background_tasks.create(feeds.refresh_home_feeds(config.feeds.home_refresh_interval), name="refresh_home_feeds")
+    background_tasks.create(accounting.watch_budgets(config.accounting.check_interval), name="watch_budgets")
+    background_tasks.create(events.pipeline.run(), name="events")
+    if config.accounting.count_websocket_bytes: accounting.count_websocket_bytes(config.accounting.websocket_sample_rate)
     logger.info("server_initialized")
 
+app.on_shutdown(events.pipeline.flush)
+
+@traced
 def validate_page(page_id: str) -> Page:
     page_id = page_id.lower()
-    stored_page = db.get_page(page_id)
+    stored_page = beanops.get_page(page_id)
+    # with the breaker open a cache miss says nothing about whether the page exists
+    if not stored_page and db_breaker.is_open: raise HTTPException(status_code=503, detail="Service temporarily unavailable")
     if not stored_page: raise HTTPException(status_code=404, detail=f"{page_id} not found")
     return stored_page
 
@@ -152,15 +174,15 @@ def validate_bean(url: str) -> Page:
 #     if not bean: raise HTTPException(status_code=404, detail=f"{bean_id} not found")
 #     return bean
 
-def validate_doc(doc_id: str):
-    if not bool(os.path.exists(f"docs/{doc_id}")):
-        raise HTTPException(status_code=404, detail=f"{doc_id} not found")
-    return f"./docs/{doc_id}"
+def validate_doc(request: Request, doc_id: str):
+    response = assets.manifest.response(request, f"/docs/{doc_id}")
+    if not response: raise HTTPException(status_code=404, detail=f"{doc_id} not found")
+    return response
 
-def validate_image(image_id: str):
-    if not bool(os.path.exists(f"images/{image_id}")):
-        raise HTTPException(status_code=404, detail=f"{image_id} not found")
-    return f"./images/{image_id}"
+def validate_image(request: Request, image_id: str):
+    response = assets.manifest.response(request, f"/images/{image_id}")
+    if not response: raise HTTPException(status_code=404, detail=f"{image_id} not found")
+    return response
 
 def validate_registration():
     userinfo = app.storage.browser.get(REGISTRATION_INFO_KEY)
@@ -169,6 +191,7 @@ def validate_registration():
     del app.storage.browser[REGISTRATION_INFO_KEY]
     return userinfo
 
+@traced
 def validate_authenticated_user():
     token = app.storage.browser.get(JWT_TOKEN_KEY)
     if not token:
@@ -177,7 +200,7 @@ def validate_authenticated_user():
     if not data:
         del app.storage.browser[JWT_TOKEN_KEY]
         raise HTTPException(status_code=401, detail="Unauthorized")
-    user = beanops.db.get_user(data["email"])
+    user = beanops.get_user(data["email"])
     if not user:
         del app.storage.browser[JWT_TOKEN_KEY]
         raise HTTPException(status_code=401, detail="Unauthorized")
@@ -258,27 +281,49 @@ async def logout_user(user: beanops.User|str = Depends(validate_authenticated_us
 async def delete_user(user: beanops.User|str = Depends(validate_authenticated_user)):
     log("delete_user", user_id=user)
     beanops.db.delete_user(user.email)
+    beanops.invalidate_user(user.email)
     if JWT_TOKEN_KEY in app.storage.browser:
         del app.storage.browser[JWT_TOKEN_KEY]
     return RedirectResponse("/")
 
 @app.get("/docs/{doc_id}")
 async def document(request: Request,
-    doc_id: str = Depends(validate_doc, use_cache=True)
+    doc_id: str = Path(),
+    response = Depends(validate_doc, use_cache=True)
 ):
     context = create_context(doc_id, request)
     context.log('read doc')
-    return FileResponse(doc_id, media_type="text/markdown")
+    return response
     
 @app.get("/images/{image_id}")
-async def image(image_id: str = Depends(validate_image, use_cache=True)):    
-    return FileResponse(image_id, media_type="image/png")
+async def image(response = Depends(validate_image, use_cache=True)):    
+    return response
+
+@app.get("/img")
+async def image_proxy(request: Request, u: str = Query(..., min_length=10), w: int = Query(images.THUMBNAIL_WIDTH, ge=16, le=1024), s: str = Query(...)):
+    if not images.verify(u, w, s): raise HTTPException(status_code=403, detail="Forbidden")
+    format = "webp" if "image/webp" in request.headers.get("accept", "") else "jpeg"
+    try: path = await images.get_thumbnail(u, w, format)
+    except Exception as err:
+        # the origin still has it so let the browser go there instead of showing a broken image
+        log("image_proxy_error", url=u, error=str(err))
+        return RedirectResponse(u)
+    return FileResponse(path, media_type=images.CONTENT_TYPES[format], headers={
+        "Cache-Control": f"public, max-age={config.images.max_age}, immutable",
+        "Vary": "Accept"
+    })
+
+app.include_router(profiling.router) # off unless PROFILING_ENABLED is set
+
+@app.get("/admin/metrics", dependencies=[Depends(verify_admin_key)])
+async def admin_metrics():
+    return {**metrics.snapshot(), **accounting.snapshot(), "events": events.pipeline.stats()}
 
 @ui.page("/")
 @limiter.limit(LIMIT_5_A_MINUTE, error_message=LIMIT_ERROR_MSG)
 async def home(request: Request):
     context = create_context("home", request)  
-    context.last_ndays = 2
+    context.last_ndays = config.feeds.home_window
     await vanilla.render_home_page(context)
 
 @ui.page("/sources/{source_id}")
@@ -383,10 +428,13 @@ async def register_user(request: Request, userinfo: dict = Depends(validate_regi
     await vanilla.render_registration(context)
 
 def run():
+    configure_tracing(config.tracing.exporter, config.tracing.sample_ratio)
+    instrument_app(app)
+    app.middleware("http")(snapshots.serve_snapshot) # anonymous visitors and crawlers get pre-rendered pages
     app.add_middleware(SessionMiddleware, secret_key=os.getenv('APP_STORAGE_SECRET')) # needed for oauth
     app.state.limiter = limiter
     app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
-    ui.add_head_html(read_file(renderer.SEO_HTML), shared=True)
+    ui.add_head_html(assets.manifest.rewrite(read_file(renderer.SEO_HTML)), shared=True)
     ui.add_head_html(renderer.MATERIAL_ICONS, shared=True)
     ui.add_head_html(renderer.GOOGLE_ANALYTICS_SCRIPT, shared=True)
     ui.run(
@@ -0,0 +1,163 @@
+import asyncio
+import os
+import re
+import time
+import glob
+import hashlib
+import threading
+from collections import OrderedDict
+from html import escape
+from urllib.parse import unquote
+from starlette.requests import Request
+from starlette.responses import FileResponse, HTMLResponse
+from app.pybeansack.models import *
+from app.pybeansack.mongosack import TRENDING, LATEST
+from app.shared.env import *
+from app.shared.consts import *
+from app.web import assets, beanops, feeds, fragments, lanes, metrics
+from app.web.caching import on_data_refresh
+from app.web.utils import read_file
+
+# pre-rendered html for anonymous visitors and crawlers so that they cost a file read instead of a live nicegui client
+SNAPSHOT_ROUTES = re.compile(r"^/(?:(sources|categories|entities|regions)/([^/]+))?$")
+BOT_AGENTS = re.compile(r"bot|crawl|spider|slurp|facebookexternalhit|embedly|preview|curl|wget", re.IGNORECASE)
+SESSION_COOKIE = "session" # set by the session middleware on the first live visit
+LIVE_COOKIE = "espressolive" # set by the snapshot itself as soon as the visitor interacts with it
+
+# on the first interaction the page flags the browser as live and reloads into the interactive app.
+# the reload carries a query parameter so that it is never answered by a cached snapshot, the cookie takes over from there
+HYDRATE_SCRIPT = f"""
+<script>
+(function() {{
+  var hydrate = function(e) {{
+    if (e.target.closest && e.target.closest("a")) return;
+    document.cookie = "{LIVE_COOKIE}=1; path=/; max-age=31536000; samesite=lax";
+    location.replace(location.pathname + "?live=1");
+  }};
+  ["click", "keydown", "touchstart"].forEach(function(t) {{ document.addEventListener(t, hydrate, {{once: true}}); }});
+}})();
+</script>
+"""
+
+SEO_HEAD = assets.manifest.rewrite(read_file(config.snapshots.seo_html))
+STYLES = read_file(config.snapshots.css_file)
+
+_stale_before = 0.0
+_snapshots: OrderedDict[str, tuple[str, float]] = OrderedDict() # path -> (file, written at), least recently served first
+_snapshots_lock = threading.Lock()
+_builds: dict[str, asyncio.Task] = {}
+
+def purge_snapshots():
+    """Deletes the snapshot files left by a previous run since they are not tracked. Only touches the files this module writes"""
+    for file in glob.glob(os.path.join(config.snapshots.dir, "*.html")) + glob.glob(os.path.join(config.snapshots.dir, "*.html.*.tmp")):
+        try: os.remove(file)
+        except FileNotFoundError: pass
+
+@on_data_refresh
+def _expire_snapshots():
+    global _stale_before
+    _stale_before = time.time()
+
+def wants_snapshot(request: Request) -> bool:
+    """Crawlers always get the snapshot. So do cold visitors that never opened a live session, as long as the url carries no filters"""
+    if request.method != "GET" or request.query_params or not SNAPSHOT_ROUTES.match(request.url.path): return False
+    if BOT_AGENTS.search(request.headers.get("user-agent", "")): return True
+    return SESSION_COOKIE not in request.cookies and LIVE_COOKIE not in request.cookies
+
+def _load_beans(page_type: str, page_id: str) -> list[Bean]:
+    kind, sort_by, limit = config.filters.page.default_kind, TRENDING if config.filters.page.default_sort_by == "Trending" else LATEST, config.snapshots.max_beans
+    if not page_type: return feeds.get_beans_for_home(kind, None, None, config.feeds.home_window, sort_by, 0, limit)
+    if page_type == "sources": return beanops.get_beans_for_custom_page(kind, None, [page_id], config.filters.page.default_window, sort_by, 0, limit)
+    return beanops.get_beans_for_custom_page(kind, [page_id], None, config.filters.page.default_window, sort_by, 0, limit)
+
+def _bean_card(bean: Bean) -> str:
+    summary = f'<p class="bean-body truncate-multiline">{escape(bean.summary)}</p>' if bean.summary else ""
+    return f'<article class="q-pa-sm">{fragments.bean_header_html(bean)}{summary}<a href="{escape(bean.url, quote=True)}" rel="noopener" target="_blank">Read More ...</a></article>'
+
+def render_snapshot(page_type: str, page_id: str, beans: list[Bean]) -> str:
+    banner = page_id if page_type else HOME_BANNER_TEXT
+    if page_type == "categories": banner = f"🏷️ {page_id}"
+    elif page_type == "regions": banner = f"📍 {page_id}"
+    cards = "".join(map(_bean_card, beans)) if beans else f"<p>{escape(NOTHING_FOUND)}</p>"
+    return "".join([
+        "<!DOCTYPE html><html lang=\"en\"><head>",
+        f"<title>{escape(banner)} - {escape(config.app.description)}</title>",
+        SEO_HEAD,
+        f"<style>{STYLES}</style>",
+        "</head><body class=\"body--dark\" style=\"background-color: #121212;\">",
+        f"<main class=\"q-pa-md\"><h1 class=\"text-h5\">{escape(banner)}</h1><div class=\"column q-gutter-md\">{cards}</div></main>",
+        HYDRATE_SCRIPT,
+        "</body></html>"
+    ])
+
+def _snapshot_path(path: str) -> str:
+    return os.path.join(config.snapshots.dir, hashlib.sha1(path.encode()).hexdigest()+".html")
+
+def _is_fresh(path: str) -> bool:
+    # goes by the time the snapshot was written as tracked in memory, so serving a hit never stats the disk
+    with _snapshots_lock: entry = _snapshots.get(path)
+    return bool(entry) and entry[1] > _stale_before and time.time() - entry[1] < config.snapshots.ttl
+
+def _lookup(path: str) -> str|None:
+    """File of the snapshot of `path` if one was written and not evicted since"""
+    with _snapshots_lock:
+        entry = _snapshots.get(path)
+        if entry: _snapshots.move_to_end(path)
+    return entry[0] if entry else None
+
+def _store(path: str, html: str) -> str:
+    """Writes the snapshot and evicts the least recently served ones beyond `max_files` so that the disk use stays bounded"""
+    file = _snapshot_path(path)
+    os.makedirs(config.snapshots.dir, exist_ok=True)
+    temp = f"{file}.{threading.get_ident()}.tmp"
+    with open(temp, "w") as f: f.write(html)
+    os.replace(temp, file)
+    evicted = []
+    with _snapshots_lock:
+        _snapshots[path] = (file, time.time())
+        _snapshots.move_to_end(path)
+        while len(_snapshots) > config.snapshots.max_files: evicted.append(_snapshots.popitem(last=False)[1][0])
+    for stale in evicted:
+        try: os.remove(stale)
+        except FileNotFoundError: pass
+    return file
+
+def build_snapshot(path: str) -> str|HTMLResponse|None:
+    """Writes the snapshot of `path` to disk and returns its file path. 
+    Pages that come up empty (e.g. made up source ids) are rendered but not kept so that random urls cannot fill the disk"""
+    page_type, page_id = SNAPSHOT_ROUTES.match(path).groups()
+    page_id = unquote(page_id) if page_id else None
+    beans = _load_beans(page_type, page_id)
+    if beans is None: return _lookup(path) # circuit is open, serve whatever is on disk
+    html = render_snapshot(page_type, page_id, beans)
+    metrics.increment("snapshot_build")
+    if not beans and page_type: return HTMLResponse(html, headers=_cache_headers(config.snapshots.ttl))
+    return _store(path, html)
+
+def _cache_headers(ttl: int) -> dict:
+    # shared caches keep it for max_age while browsers revalidate so that a visitor who went live gets the app on the next load.
+    # not varied by cookie or user agent so that a CDN can actually cache it: route live sessions around the CDN by their cookies instead
+    return {"Cache-Control": f"public, max-age=0, s-maxage={config.snapshots.max_age}, stale-while-revalidate={ttl}"}
+
+async def _build(path: str):
+    """Concurrent builds of the same path share one run on the expensive lane"""
+    task = _builds.get(path)
+    if not task:
+        task = _builds[path] = asyncio.create_task(lanes.expensive.run(build_snapshot, path))
+        task.add_done_callback(lambda _: _builds.pop(path, None))
+    return await asyncio.shield(task)
+
+async def serve_snapshot(request: Request, call_next):
+    """HTTP middleware that answers anonymous and crawler hits to the feed routes with the pre-rendered snapshot"""
+    if not wants_snapshot(request): return await call_next(request)
+    path = request.url.path
+    file = _lookup(path)
+    if not file or not _is_fresh(path):
+        try: file = await _build(path)
+        except Exception as err:
+            log("snapshot_build_error", path=path, error=str(err))
+            file = _lookup(path)
+    if isinstance(file, HTMLResponse): return file
+    if not file: return await call_next(request)
+    metrics.increment("snapshot_hit")
+    return FileResponse(file, media_type="text/html", headers=_cache_headers(config.snapshots.ttl))
@@ -1,17 +1,19 @@
 from app.shared.consts import *
 from app.shared.env import *
-from app.web import beanops
+from app.web import beanops, feeds
 from app.pybeansack.models import *
 from app.web.context import *
 from app.web.renderer import *
 from app.web.custom_ui import *
 from nicegui import ui
+from app.shared.tracing import traced
 
 from app.pybeansack.mongosack import TRENDING, LATEST
 
 BARISTAS_PANEL_CLASSES = "w-1/4 gt-xs"
 MAINTAIN_VALUE = "__MAINTAIN_VALUE__"
 
+@traced
 async def render_home_page(context: Context):
     _, _, nav_panel, _ = render_frame(context)
     render_banner("News, Blogs & Articles").classes("w-full")
@@ -20,13 +22,11 @@ async def render_home_page(context: Context):
     pages_panel = ui.row().classes("w-full gap-1")    
     
     def retrieve_briefings(start, limit):
-        context.log("retrieve", start=start, limit=limit)
         return beanops.get_generated_beans(None, tags=context.tags, last_ndays=context.last_ndays, start=start, limit=limit)
 
     # feeds related functions
     def retrieve_feeds(start, limit):
-        context.log("retrieve", start=start, limit=limit)
-        return beanops.get_beans_for_home(context.kind, context.tags, None, context.last_ndays, context.sort_by, start, limit)
+        return feeds.get_beans_for_home(context.kind, context.tags, None, context.last_ndays, context.sort_by, start, limit)
     
     get_filter_tags = lambda: beanops.get_filter_tags_for_custom_page(tags=None, sources=None, last_ndays=context.last_ndays, start=0, limit=config.filters.page.max_tags)
 
@@ -62,6 +62,7 @@ async def render_home_page(context: Context):
 #                     render_error_text(NOTHING_TRENDING)                            
 #     render_footer()
 
+@traced
 async def render_stored_page(context: Context):  
     _, _, nav_panel, _ = render_frame(context)
     render_page_banner(context).classes("w-full")
@@ -70,12 +71,10 @@ async def render_stored_page(context: Context):
     pages_panel = ui.row().classes("w-full gap-1")
    
     def retrieve_briefings(start, limit):
-        context.log("retrieve", start=start, limit=limit)
         return beanops.get_generated_beans(context.page, tags=context.tags, last_ndays=context.last_ndays, start=start, limit=limit)
     
     def retrieve_feeds(start, limit):
-        context.log("retrieve", start=start, limit=limit)
-        return beanops.get_beans_for_stored_page(context.page, context.kind, context.tags, context.last_ndays, context.sort_by, start, limit)
+        return feeds.get_beans_for_stored_page(context.page, context.kind, context.tags, context.last_ndays, context.sort_by, start, limit)
         
     get_filter_tags = lambda: beanops.get_filter_tags_for_stored_page(context.page, context.last_ndays, 0, config.filters.page.max_tags)
 
@@ -90,6 +89,7 @@ async def render_stored_page(context: Context):
         _load_and_render_feeds_panel(context, retrieve_feeds, feeds_panel, get_filter_tags, apply_filter)
     ])
 
+@traced
 async def render_custom_page(context: Context): 
     _, _, nav_panel, _ = render_frame(context)
     render_page_banner(context).classes("w-full")
@@ -98,11 +98,9 @@ async def render_custom_page(context: Context):
     pages_panel = ui.row().classes("w-full gap-1")
 
     def retrieve_briefings(start, limit):
-        context.log("retrieve", start=start, limit=limit)
         return beanops.get_generated_beans(None, tags=context.tags, last_ndays=context.last_ndays, start=start, limit=limit)
 
     def retrieve_feeds(start, limit):
-        context.log("retrieve", start=start, limit=limit)
         return beanops.get_beans_for_custom_page(context.kind, tags=context.tags, sources=context.sources, last_ndays=context.last_ndays, sort_by=context.sort_by, start=start, limit=limit)
         
     get_filter_tags = lambda: beanops.get_filter_tags_for_custom_page(context.tags, context.sources, context.last_ndays, 0, config.filters.page.max_tags)
@@ -122,6 +120,7 @@ async def render_custom_page(context: Context):
     
     await asyncio.gather(*tasks)
 
+@traced
 async def render_bean_page(context: Context):
     bean = context.page
     await load_and_render_frame(context)
@@ -133,7 +132,6 @@ async def render_bean_page(context: Context):
     
     # related beans related functions
     def retrieve_related(start, limit):
-        context.log("retrieve", start=start, limit=limit)
         return beanops.get_similar_beans(bean, context.kind, tags=context.tags, sources=context.sources, last_ndays=context.last_ndays, sort_by=context.sort_by, start=start, limit=limit)
 
     get_filters_items = lambda: random.sample(bean.entities, min(len(bean.entities), config.filters.page.max_tags)) if bean.entities else None
@@ -151,7 +149,7 @@ async def _load_and_render_briefings_panel(context: Context, retrieve_beans: Cal
     panel = None
     with container:
         sk = render_skeleton_beans(2)
-        has_briefings = await run.io_bound(retrieve_beans, 0, 1)
+        has_briefings = await run_expensive(retrieve_beans, 0, 1)
         if has_briefings:
             panel = (await load_and_render_beans_as_extendable_list(context, retrieve_beans))
             render_thick_separator()
@@ -199,6 +197,7 @@ async def _load_and_render_feeds_panel(
     #         )
     #         if tags_panel: tags_panel.classes("w-full lg:w-auto")
 
+@traced
 async def render_search(context: Context): 
     initial_tags, context.kind = context.tags, config.filters.page.default_kind
 
@@ -207,15 +206,11 @@ async def render_search(context: Context):
 
     def retrieve_beans(start, limit):
         context.log("retrieve", start=start, limit=limit)
-        return beanops.search_beans(context.query, context.accuracy, context.kind, context.tags, context.sources, context.last_ndays, start, limit)
+        return beanops.search_beans_with_count(context.query, context.accuracy, context.kind, context.tags, context.sources, context.last_ndays, start, limit)
     
     @ui.refreshable
     async def render_search_result():
-        panel = await load_and_render_beans_as_paginated_list(
-            context, 
-            retrieve_beans, 
-            lambda: beanops.count_search_beans(context.query, context.accuracy, context.kind, context.tags, context.sources, context.last_ndays, beanops.MAX_LIMIT)
-        )
+        panel = await load_and_render_beans_as_paginated_list(context, retrieve_beans)
         return panel.classes("w-full")               
 
     def apply_filter(
@@ -248,6 +243,7 @@ async def render_registration(context: Context):
 
     async def success():
         beanops.db.create_user(userinfo, config.filters.page.default_channels)
+        beanops.invalidate_user(userinfo["email"])
         context.log("registered")
         internal_nav()
 
@@ -0,0 +1,40 @@
+"""Measures the memory held by 10k cached feed results as pydantic `Bean`s against the slotted `BeanHeader`s that beanops caches now.
+Run from the repo root with the web app's .env in place: python -m benchmarks.bean_memory"""
+import gc
+import random
+import tracemalloc
+from datetime import datetime, timedelta
+from app.pybeansack.models import Bean
+from app.web import beanops
+
+COUNT = 10_000
+
+def make_rows(n: int) -> list[dict]:
+    """Documents shaped like a BEAN_HEADER_FIELDS projection of the beanstore"""
+    now = datetime.now()
+    return [{
+        "_id": f"https://example.com/{i}", "url": f"https://example.com/{i}", "title": f"Bean number {i} with a title of a realistic length",
+        "created": now - timedelta(hours=random.randint(1, 72)), "kind": "news", "image_url": f"https://example.com/{i}.jpg",
+        "source": "example.com", "author": "Jane Doe", "categories": ["Artificial Intelligence", "Software Engineering"],
+        "entities": ["OpenAI", "Microsoft", "Europe"], "regions": ["Europe"],
+        "likes": random.randint(0, 500), "comments": random.randint(0, 100), "shares": random.randint(0, 10),
+        "cluster_id": f"https://example.com/{i//3}", "cluster_size": 3
+    } for i in range(n)]
+
+def measure(build, rows: list[dict]) -> int:
+    """Bytes still allocated after building one record per row. The string values stay shared with the rows so this is the per-record overhead"""
+    gc.collect()
+    tracemalloc.start()
+    records = [build(row) for row in rows]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return size
+
+if __name__ == "__main__":
+    rows = make_rows(COUNT)
+    beans = measure(lambda row: Bean(**{**row, "id": row["_id"]}), rows)
+    headers = measure(beanops.BeanHeader.from_row, rows)
+    print(f"{'Bean':>10}: {beans/1024:10.1f} KB per {COUNT} records")
+    print(f"{'BeanHeader':>10}: {headers/1024:10.1f} KB per {COUNT} records")
+    print(f"{'ratio':>10}: {beans/headers:10.1f}x more records per MB as headers")
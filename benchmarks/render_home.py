@@ -0,0 +1,63 @@
+"""Times rendering the bean card headers of one home page: the nicegui element tree that renderer used to build per card
+against the shared html fragments, cold (every card rebuilt) and warm (served from the fragment cache).
+Run from the repo root with the web app's .env in place: python -m benchmarks.render_home"""
+import random
+import time
+from datetime import datetime, timedelta
+from nicegui import ui
+from app.shared.consts import MAX_LIMIT
+from app.web import beanops, fragments
+from app.web.utils import *
+
+PAGES = 20 # home page renders per measurement
+
+def make_beans(n: int) -> list:
+    now = datetime.now()
+    return [beanops.BeanHeader(
+        id=f"bean-{i}", url=f"https://example.com/{i}", title=f"Bean number {i} with a title of a realistic length",
+        created=now - timedelta(hours=random.randint(1, 72)), kind="news", image_url=f"https://example.com/{i}.jpg",
+        source="example.com", author="Jane Doe", categories=["Artificial Intelligence"], regions=["Europe"],
+        likes=random.randint(0, 500), comments=random.randint(0, 100), shares=random.randint(0, 10)
+    ) for i in range(n)]
+
+def _chip(title: str, max_width: str = "25ch"):
+    with ui.chip(color="transparent").props("dense flat").classes(f"{fragments.BEAN_TAG_CLASSES} max-w-[{max_width}]").tooltip(title) as view:
+        ui.label(title).classes("ellipsis")
+    return view
+
+def element_header(bean):
+    """The per-card element tree from before the fragment cache"""
+    with ui.row(wrap=False, align_items="stretch").classes("w-full bean-header"):
+        if bean.image_url: ui.image(bean.image_url).classes(fragments.BEAN_IMAGE_CLASSES)
+        with ui.element().classes("w-full"):
+            ui.label(bean.title).classes("bean-title")
+            with ui.row(align_items="center").classes("gap-2 q-my-xs"):
+                _chip(naturalday(bean.created))
+                _chip(site_name(bean)).props("icon=img:"+favicon(bean))
+                if bean.author: _chip(f"✍️ {bean.author}", "15ch")
+                if bean.categories: _chip(f"🏷️ {bean.categories[0]}")
+                if bean.regions: _chip(f"📍 {bean.regions[0]}")
+
+def fragment_header(bean):
+    ui.html(fragments.bean_header_html(bean)).classes("w-full")
+
+def measure(render, beans: list, clear_cache: bool) -> float:
+    elapsed = 0.0
+    for _ in range(PAGES):
+        if clear_cache: fragments._fragments.clear()
+        with ui.element() as container:
+            start = time.perf_counter()
+            for bean in beans: render(bean)
+            elapsed += time.perf_counter() - start
+        container.delete()
+    return elapsed / PAGES
+
+if __name__ == "__main__":
+    beans = make_beans(MAX_LIMIT)
+    results = {
+        "elements": measure(element_header, beans, False),
+        "fragments (cold)": measure(fragment_header, beans, True),
+        "fragments (warm)": measure(fragment_header, beans, False)
+    }
+    for name, seconds in results.items():
+        print(f"{name:>18}: {seconds*1000:8.2f} ms per page of {len(beans)} cards, {results['elements']/seconds:5.1f}x")
@@ -0,0 +1,40 @@
+import pytest
+from starlette.requests import Request
+from app.web import assets
+
+BODY = b"body { color: #4e392a; }\n" * 64
+
+@pytest.fixture
+def manifest(tmp_path):
+    (tmp_path / "styles.css").write_bytes(BODY)
+    return assets.AssetManifest({"docs": str(tmp_path)}).build()
+
+def _get(manifest, path: str, **headers):
+    scope = {"type": "http", "method": "GET", "path": path, "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]}
+    return manifest.response(Request(scope), path)
+
+def test_each_encoding_gets_its_own_etag(manifest):
+    plain, gzipped = _get(manifest, "/docs/styles.css"), _get(manifest, "/docs/styles.css", accept_encoding="gzip, deflate")
+    assert gzipped.headers["Content-Encoding"] == "gzip" and "Content-Encoding" not in plain.headers
+    assert plain.headers["ETag"] != gzipped.headers["ETag"]
+    assert plain.body == BODY and len(gzipped.body) < len(BODY)
+
+def test_if_none_match_only_matches_the_same_encoding(manifest):
+    plain_etag = _get(manifest, "/docs/styles.css").headers["ETag"]
+    gzip_etag = _get(manifest, "/docs/styles.css", accept_encoding="gzip").headers["ETag"]
+    assert _get(manifest, "/docs/styles.css", accept_encoding="gzip", if_none_match=gzip_etag).status_code == 304
+    assert _get(manifest, "/docs/styles.css", accept_encoding="gzip", if_none_match=plain_etag).status_code == 200
+    assert _get(manifest, "/docs/styles.css", if_none_match=gzip_etag).status_code == 200
+
+def test_if_none_match_lists_weak_tags_and_wildcard(manifest):
+    etag = _get(manifest, "/docs/styles.css", accept_encoding="gzip").headers["ETag"]
+    assert _get(manifest, "/docs/styles.css", accept_encoding="gzip", if_none_match=f'"stale", W/{etag}').status_code == 304
+    assert _get(manifest, "/docs/styles.css", accept_encoding="gzip", if_none_match='"stale", "older"').status_code == 200
+    assert _get(manifest, "/docs/styles.css", if_none_match="*").status_code == 304
+
+def test_hashed_url_is_immutable(manifest):
+    hashed = manifest.url("/docs/styles.css")
+    assert hashed != "/docs/styles.css"
+    assert _get(manifest, hashed).headers["Cache-Control"] == assets.IMMUTABLE
+    assert "must-revalidate" in _get(manifest, "/docs/styles.css").headers["Cache-Control"]
+    assert manifest.rewrite('<link href="/docs/styles.css">') == f'<link href="{hashed}">'
@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+import pytest
+from app.pybeansack.models import Page
+from app.web import beanops
+
+def test_edited_page_gets_new_cache_keys():
+    page = Page(id="ai", query_tags=["Artificial Intelligence"])
+    edited = Page(id="ai", query_tags=["Artificial Intelligence", "Robotics"])
+    key = lambda page: beanops.canonical_filter_key(page, None, None, 1, None, 0, 10)
+    assert key(page) == key(Page(id="ai", query_tags=["Artificial Intelligence"]))
+    assert key(page) != key(edited)
+
+def test_page_version_follows_urls_and_embedding():
+    page = Page(id="me@example.com", query_urls=["https://example.com/a"])
+    assert beanops.page_version(page) != beanops.page_version(Page(id="me@example.com", query_urls=["https://example.com/a", "https://example.com/b"]))
+    assert beanops.page_version(Page(id="p", query_embedding=[0.1, 0.2])) != beanops.page_version(Page(id="p", query_embedding=[0.2, 0.1]))
+
+class _FakeBeansack:
+    """Bookmarks page of one user. Every feed query answers with whatever is bookmarked at that moment"""
+    def __init__(self, email: str, urls: list[str]):
+        self.email, self.urls = email, list(urls)
+
+    def get_page(self, id, project=None):
+        return Page(id=self.email, query_urls=list(self.urls)) if id == self.email else None
+
+    def bookmark(self, user, url):
+        self.urls.append(url)
+
+    def query_beans(self, filter=None, sort_by=None, skip=0, limit=0, project=None, **kwargs):
+        return [SimpleNamespace(url=url) for url in self.urls][skip:skip+limit]
+
+def test_new_bookmark_shows_up_on_next_feed_load(monkeypatch):
+    email = "reader@example.com"
+    monkeypatch.setattr(beanops, "db", _FakeBeansack(email, ["https://example.com/a"]))
+    context = SimpleNamespace(user=SimpleNamespace(email=email))
+    load_feed = lambda: [bean.url for bean in beanops.get_beans_for_stored_page(beanops.get_page(email), None, None, None, None, 0, 10)]
+
+    assert load_feed() == ["https://example.com/a"]
+    beanops.bookmark(context, "https://example.com/b")
+    assert load_feed() == ["https://example.com/a", "https://example.com/b"]
+
+def test_canonical_tag_keeps_letters_of_any_script():
+    assert beanops.canonical_tag("AI-Agents") == beanops.canonical_tag("ai agents") == "aiagents"
+    assert beanops.canonical_tag("São Paulo") == "sãopaulo"
+    assert beanops.canonical_tag("Café") == "café"
+    assert beanops.canonical_tag("北京") == "北京" and beanops.canonical_tag("東京") == "東京"
+    assert beanops.canonical_tag("Россия") == "россия"
+    assert len({beanops.canonical_tag(tag) for tag in ["北京", "東京", "Россия"]}) == 3
+    assert beanops.canonical_tag("") == "" and beanops.canonical_tag(None) == ""
+
+def test_empty_tags_make_no_filter():
+    assert beanops._make_tags_filter([]) is None
+    assert "$and" not in beanops.create_filter(None, [], None, None, None, None)
+
+def test_bean_header_reads_undeclared_bean_fields_as_none():
+    header = beanops.BeanHeader(url="https://example.com/a", title="A")
+    assert header.title == "A" and header.summary is None
+    assert header.content is None # a Bean field a header does not carry
+    with pytest.raises(AttributeError): header.titel
+    assert not hasattr(header, "model_dump")
@@ -0,0 +1,93 @@
+import threading
+import time
+import pytest
+from app.web import caching
+from app.web.caching import CircuitBreaker, CircuitOpenError, swr_cached
+
+def _breaker(cooldown: float = 0.1) -> CircuitBreaker:
+    return CircuitBreaker(window=10, min_calls=2, max_failure_rate=0.5, slow_call=1.0, cooldown=cooldown)
+
+def _fail():
+    raise RuntimeError("db down")
+
+def _trip(breaker: CircuitBreaker):
+    while breaker.state == "closed":
+        with pytest.raises(RuntimeError): breaker.call(_fail)
+
+def test_breaker_opens_and_fails_fast():
+    breaker = _breaker()
+    _trip(breaker)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError): breaker.call(lambda: "ok")
+
+def test_breaker_admits_one_probe_when_half_open():
+    breaker = _breaker()
+    _trip(breaker)
+    time.sleep(0.15)
+    assert breaker.state == "half-open"
+    release, probing = threading.Event(), threading.Event()
+    def probe():
+        probing.set()
+        release.wait()
+        return "ok"
+    thread = threading.Thread(target=breaker.call, args=(probe,))
+    thread.start()
+    probing.wait()
+    # everything but the probe keeps failing fast
+    with pytest.raises(CircuitOpenError): breaker.call(lambda: "ok")
+    release.set()
+    thread.join()
+    assert breaker.state == "closed"
+    assert breaker.call(lambda: "ok") == "ok"
+
+def test_breaker_reopens_on_unhealthy_probe():
+    breaker = _breaker()
+    _trip(breaker)
+    time.sleep(0.15)
+    with pytest.raises(RuntimeError): breaker.call(_fail)
+    assert breaker.state == "open"
+
+def test_breaker_ignores_calls_in_flight_when_it_opened():
+    breaker = _breaker(cooldown=10)
+    _trip(breaker)
+    breaker.record(True, 0.01)
+    assert breaker.state == "open"
+
+def _counter():
+    calls = []
+    def read(key):
+        calls.append(key)
+        return len(calls)
+    return calls, read
+
+def test_swr_serves_stale_while_revalidating(monkeypatch):
+    monkeypatch.setattr(caching, "db_breaker", _breaker())
+    calls, read = _counter()
+    cached = swr_cached(max_size=10, ttl=0.1, max_stale=10)(read)
+    assert cached("a") == 1
+    assert cached("a") == 1 and len(calls) == 1 # fresh
+    time.sleep(0.15)
+    assert cached("a") == 1 # stale value right away
+    deadline = time.time() + 2
+    while cached("a") != 2 and time.time() < deadline: time.sleep(0.01)
+    assert cached("a") == 2 and len(calls) == 2
+
+def test_swr_serves_only_stale_while_the_breaker_is_open(monkeypatch):
+    breaker = _breaker(cooldown=10)
+    monkeypatch.setattr(caching, "db_breaker", breaker)
+    calls, read = _counter()
+    cached = swr_cached(max_size=10, ttl=0.05, max_stale=10)(read)
+    assert cached("a") == 1
+    _trip(breaker)
+    time.sleep(0.1)
+    assert cached("a") == 1
+    assert cached("b") is None
+    time.sleep(0.05)
+    assert calls == ["a"]
+
+def test_swr_does_not_cache_none_when_asked(monkeypatch):
+    monkeypatch.setattr(caching, "db_breaker", _breaker())
+    results = [None, "page"]
+    cached = swr_cached(max_size=10, ttl=60, cache_none=False)(lambda id: results.pop(0))
+    assert cached("p") is None
+    assert cached("p") == "page"
@@ -0,0 +1,113 @@
+import asyncio
+import io
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from PIL import Image
+from app.web import images
+
+def _png(width: int = 512, height: int = 512) -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(output, format="PNG")
+    return output.getvalue()
+
+class _Origin(BaseHTTPRequestHandler):
+    """Stand-in origin: /image.png is slow enough for concurrent misses to overlap, /redirect points at another host"""
+    image = _png()
+    hits = 0
+
+    def do_GET(self):
+        if self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", f"http://localhost:{self.server.server_port}/image.png")
+            self.end_headers()
+            return
+        type(self).hits += 1
+        time.sleep(0.2)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(self.image)))
+        self.end_headers()
+        self.wfile.write(self.image)
+
+    def log_message(self, *args): pass
+
+@pytest.fixture(autouse=True)
+def secret(monkeypatch):
+    monkeypatch.setenv("APP_STORAGE_SECRET", "test-secret")
+
+@pytest.fixture
+def origin(monkeypatch):
+    # the stand-in origin listens on loopback, which the proxy otherwise refuses to fetch from
+    monkeypatch.setattr(images, "_is_public", lambda address: address.is_loopback or address.is_global)
+    _Origin.hits = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Origin)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+@pytest.fixture
+def thumbnails(tmp_path, monkeypatch):
+    cache = images.ThumbnailCache(str(tmp_path), 1 << 20)
+    monkeypatch.setattr(images, "thumbnails", cache)
+    return cache
+
+def test_signature_rejection():
+    url = "https://example.com/image.png"
+    signature = dict(pair.split("=") for pair in images.proxy_url(url, 64).split("?")[1].split("&"))["s"]
+    assert images.verify(url, 64, signature)
+    assert not images.verify(url, 128, signature)
+    assert not images.verify("https://example.com/other.png", 64, signature)
+    assert not images.verify(url, 64, "0"*16)
+    assert not images.verify(url, 64, None)
+
+def test_nothing_is_signed_or_served_without_a_secret(monkeypatch):
+    url = "https://example.com/image.png"
+    monkeypatch.setenv("APP_STORAGE_SECRET", "")
+    assert images.proxy_url(url, 64) == url
+    assert not images.verify(url, 64, images.hmac.new(b"", f"{url}|64".encode(), images.hashlib.sha256).hexdigest()[:16])
+    monkeypatch.delenv("APP_STORAGE_SECRET")
+    assert images.proxy_url(url, 64) == url
+    assert not images.verify(url, 64, "0"*16)
+
+def test_lru_eviction(tmp_path):
+    cache = images.ThumbnailCache(str(tmp_path), 250)
+    cache.put("a", b"x"*100)
+    cache.put("b", b"x"*100)
+    assert cache.get("a") # a is now the most recently used
+    cache.put("c", b"x"*100)
+    assert cache.get("b") is None and not os.path.exists(cache.path("b"))
+    assert cache.get("a") and cache.get("c")
+
+def test_concurrent_misses_share_one_fetch(origin, thumbnails):
+    async def fetch_all():
+        return await asyncio.gather(*[images.get_thumbnail(f"{origin}/image.png", 32, "webp") for _ in range(5)])
+    paths = asyncio.run(fetch_all())
+    assert _Origin.hits == 1
+    assert len(set(paths)) == 1 and os.path.exists(paths[0])
+    with Image.open(paths[0]) as image: assert image.width == 32
+
+def test_oversized_origin_is_rejected(origin, thumbnails, monkeypatch):
+    monkeypatch.setattr(images.config.images, "max_origin_bytes", 100)
+    with pytest.raises(ValueError): asyncio.run(images.get_thumbnail(f"{origin}/image.png", 32, "webp"))
+
+def test_redirect_to_another_host_is_rejected(origin, thumbnails):
+    with pytest.raises(ValueError): asyncio.run(images.get_thumbnail(f"{origin}/redirect", 32, "webp"))
+    assert _Origin.hits == 0
+
+@pytest.mark.parametrize("url", [
+    "http://169.254.169.254/latest/meta-data/image.png", "http://10.0.0.1/image.png", "http://[::ffff:127.0.0.1]/image.png", "file:///etc/passwd"
+])
+def test_non_public_origins_are_rejected(url, thumbnails):
+    with pytest.raises(ValueError): asyncio.run(images.get_thumbnail(url, 32, "webp"))
+
+def test_loopback_origin_is_rejected(thumbnails):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Origin)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    _Origin.hits = 0
+    try:
+        with pytest.raises(ValueError): asyncio.run(images.get_thumbnail(f"http://127.0.0.1:{server.server_port}/image.png", 32, "webp"))
+        assert _Origin.hits == 0
+    finally: server.shutdown()
@@ -0,0 +1,35 @@
+import asyncio
+import threading
+from app.web.lanes import Lane
+
+def test_cancelled_call_stays_in_flight_until_the_thread_is_done():
+    lane = Lane("test", max_workers=1, max_queue=0)
+    release = threading.Event()
+
+    async def scenario():
+        task = asyncio.create_task(lane.run(release.wait))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.sleep(0.05)
+        assert lane._in_flight == 1
+        release.set()
+        await asyncio.sleep(0.05)
+        assert lane._in_flight == 0
+
+    asyncio.run(scenario())
+
+def test_call_cancelled_before_it_starts_is_released_right_away():
+    lane = Lane("test", max_workers=1)
+    release = threading.Event()
+
+    async def scenario():
+        busy = asyncio.create_task(lane.run(release.wait))
+        queued = asyncio.create_task(lane.run(lambda: None))
+        await asyncio.sleep(0.05)
+        queued.cancel()
+        await asyncio.sleep(0.05)
+        assert lane._in_flight == 1
+        release.set()
+        await busy
+
+    asyncio.run(scenario())
@@ -0,0 +1,19 @@
+from app.shared import tracing
+from app.shared.tracing import TracedProxy
+
+class _Collection:
+    database = "beansack"
+    def aggregate(self, pipeline): return []
+
+class _Beansack:
+    def __init__(self): self.beanstore = _Collection()
+    def query_beans(self): return []
+
+def test_proxy_traces_named_children():
+    tracing.configure_tracing("memory")
+    tracing.memory_exporter.clear()
+    db = TracedProxy(_Beansack(), "beansack", children=("beanstore",))
+    db.query_beans()
+    db.beanstore.aggregate([])
+    assert db.beanstore.database == "beansack"
+    assert [span.name for span in tracing.memory_exporter.get_finished_spans()] == ["beansack.query_beans", "beansack.beanstore.aggregate"]